@@ -15,6 +15,13 @@ class Settings(BaseSettings):
     
     # MegLLM
     megllm_api_key: str = ""
+    llm_cache_size: int = 4096  # Exact-match responses kept for routing prompts
+    # Reuse answers for paraphrased questions. Off by default: questions about
+    # one plant share a scope, and short ones with different meanings (e.g.
+    # "có độc không?" / "ăn được không?") can embed close together. When off,
+    # only identical requests reuse an answer.
+    llm_semantic_cache: bool = False
+    llm_semantic_cache_threshold: float = 0.03  # Max cosine distance for a hit
     
     # Embedding Model
     embedding_model_name: str = "AITeamVN/Vietnamese_Embedding"
@@ -31,6 +38,12 @@ class Settings(BaseSettings):
     # RAG settings
     chunk_max_tokens: int = 250
     retrieval_top_k: int = 20
+    rag_cache: bool = True  # Reuse retrieval results for near-identical queries
+    rag_cache_similarity: float = 0.97  # Min cosine similarity for a hit
+    rag_cache_ttl: int = 3600  # Seconds before cached results are refreshed
+    rag_cache_size: int = 2000  # Queries kept per (top_k, plant filter)
+    reformulation_semantic_cache: bool = True  # Reuse reformulations of paraphrased queries
+    reformulation_cache_similarity: float = 0.97  # Min cosine similarity for a hit
     
     class Config:
         env_file = ".env"
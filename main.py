@@ -2,32 +2,108 @@
 Main FastAPI Application
 Plant Medicine RAG Backend with 3 Flows
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+from functools import lru_cache
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import orjson
+import logging
+import logging.handlers
+import queue
+import time
 import tempfile
 import os
-import glob
 
 from config import get_settings
 from services.cv_api_client import get_cv_api_client
 from services.llm_client import get_megllm_client
 from services.embedding_service import get_embedding_service
-from services.vector_db_service import SupabaseVectorDB
+from services.vector_db_service import get_vector_db
 from services.ograg_engine import get_og_rag_engine
-from services.flow1_service import get_flow1_service
-from services.flow2_service import get_flow2_service
-from services.flow3_service import get_flow3_service
+from services.flow1_service import Flow1Service, get_flow1_service
+from services.flow2_service import Flow2Service, get_flow2_service
+from services.flow3_service import Flow3Service, get_flow3_service
 from services.query_reformulator import get_query_reformulator
 from utils.data_loader import get_plant_data_loader
 
+settings = get_settings()
+log = logging.getLogger("flow2")
+health_log = logging.getLogger("health")
+
+
+def start_log_listener() -> logging.handlers.QueueListener:
+    """Hand flow2 log records to a background thread for writing"""
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[%(name)s] %(levelname)s %(message)s"))
+    
+    log.handlers.clear()
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+def load_image_classes() -> frozenset:
+    """Plant classes that have a photo directory, read once at startup"""
+    if not os.path.isdir(settings.photos_dir):
+        return frozenset()
+    with os.scandir(settings.photos_dir) as entries:
+        return frozenset(entry.name for entry in entries
+                         if entry.is_dir() and not entry.name.startswith("."))
+
+
+def init_services(app: FastAPI):
+    """Initialize all services and attach them to app.state"""
+    print("Initializing services...")
+    state = app.state
+    state.cv_client = get_cv_api_client()
+    state.llm_client = get_megllm_client()
+    state.embed_service = get_embedding_service()
+    state.vector_db = get_vector_db(settings.supabase_url, settings.supabase_anon_key)
+    state.og_rag = get_og_rag_engine(state.embed_service, state.vector_db)
+    state.data_loader = get_plant_data_loader()
+    state.reformulator = get_query_reformulator(state.llm_client, state.embed_service)
+    state.image_classes = load_image_classes()
+    
+    # Initialize flow services
+    state.flow1 = get_flow1_service(state.cv_client, state.data_loader)
+    state.flow2 = get_flow2_service(state.cv_client, state.llm_client, state.og_rag, state.data_loader)
+    state.flow3 = get_flow3_service(state.llm_client, state.og_rag, state.reformulator)
+    
+    print("✅ All services initialized")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize services before the first request is accepted"""
+    listener = start_log_listener()
+    init_services(app)
+    try:
+        yield
+    finally:
+        await app.state.cv_client.aclose()
+        await app.state.llm_client.aclose()
+        app.state.vector_db.close()
+        listener.stop()
+
+
 # Initialize app
 app = FastAPI(
     title="Plant Medicine RAG API",
     description="Vietnamese Plant Medicine Q&A with 3 flows: Image Only, Image+Text, Pure RAG",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -39,44 +115,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services (lazy)
-settings = get_settings()
-cv_client = None
-llm_client = None
-embed_service = None
-vector_db = None
-og_rag = None
-data_loader = None
-reformulator = None
-flow1 = None
-flow2 = None
-flow3 = None
-
-
-def init_services():
-    """Initialize all services"""
-    global cv_client, llm_client, embed_service, vector_db, og_rag, data_loader, reformulator, flow1, flow2, flow3
+
+# Service dependencies
+def get_flow1(request: Request) -> Flow1Service:
+    return request.app.state.flow1
+
+
+def get_flow2(request: Request) -> Flow2Service:
+    return request.app.state.flow2
+
+
+def get_flow3(request: Request) -> Flow3Service:
+    return request.app.state.flow3
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def save_upload(file: UploadFile) -> str:
+    """
+    Stream an uploaded file to a temporary file in fixed-size chunks
     
-    if cv_client is None:
-        print("Initializing services...")
-        cv_client = get_cv_api_client()
-        llm_client = get_megllm_client()
-        embed_service = get_embedding_service()
-        vector_db = SupabaseVectorDB(
-            url=settings.supabase_url,
-            key=settings.supabase_anon_key,
-            timeout=120
-        )
-        og_rag = get_og_rag_engine(embed_service, vector_db)
-        data_loader = get_plant_data_loader()
-        reformulator = get_query_reformulator(llm_client)
-        
-        # Initialize flow services
-        flow1 = get_flow1_service(cv_client, data_loader)
-        flow2 = get_flow2_service(cv_client, llm_client, og_rag, data_loader)
-        flow3 = get_flow3_service(llm_client, og_rag, reformulator)
-        
-        print("✅ All services initialized")
+    Returns:
+        Path to the temporary file (caller is responsible for cleanup)
+    """
+    suffix = os.path.splitext(file.filename or "")[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(tmp.write, chunk)
+        return tmp.name
+
+
+def remove_file(path: Optional[str]):
+    """Delete a temporary file, ignoring files that are already gone"""
+    if path:
+        with suppress(FileNotFoundError):
+            os.unlink(path)
 
 
 # Request/Response models
@@ -97,12 +171,6 @@ class Flow3Request(BaseModel):
 
 
 # Endpoints
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    init_services()
-
-
 @app.get("/")
 async def root():
     """Health check"""
@@ -113,68 +181,112 @@ async def root():
     }
 
 
+HEALTH_PROBE_TIMEOUT = 2.0
+HEALTH_COUNT_TTL = 30.0  # Node/plant counts may be this stale in /health
+
+# probe name -> (value, expires_at); only successful results are cached
+_health_cache: Dict[str, Tuple[object, float]] = {}
+
+
+async def _probe(name: str, check, default, ttl: float = 0.0):
+    """Run a blocking health check in a thread with a timeout and optional TTL cache"""
+    now = time.monotonic()
+    cached = _health_cache.get(name)
+    if cached and cached[1] > now:
+        return cached[0]
+    
+    try:
+        value = await asyncio.wait_for(asyncio.to_thread(check), timeout=HEALTH_PROBE_TIMEOUT)
+    except Exception as e:
+        health_log.warning("%s failed: %s: %s", name, type(e).__name__, e)
+        return default
+    
+    if ttl > 0:
+        _health_cache[name] = (value, now + ttl)
+    return value
+
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness probe - no dependency I/O"""
+    return {"status": "ok"}
+
+
 @app.get("/health")
-async def health():
-    """Detailed health check"""
-    init_services()
+@app.get("/health/ready")
+async def health_ready(request: Request, response: Response):
+    """
+    Readiness probe (all dependency probes run concurrently)
+    
+    Returns 503 when any dependency is unavailable.
+    """
+    state = request.app.state
+    cv_api, vector_db, data_loader = await asyncio.gather(
+        _probe("cv_api", state.cv_client.health_check, False),
+        _probe("vector_db", state.vector_db.count_nodes, None, ttl=HEALTH_COUNT_TTL),
+        _probe("data_loader", state.data_loader.count_plants, None, ttl=HEALTH_COUNT_TTL)
+    )
+    ready = bool(cv_api) and vector_db is not None and bool(data_loader)
+    if not ready:
+        response.status_code = 503
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "unavailable",
         "services": {
-            "cv_api": cv_client.health_check() if cv_client else False,
-            "vector_db": vector_db.count_nodes() if vector_db else 0,
-            "data_loader": data_loader.count_plants() if data_loader else 0
+            "cv_api": cv_api,
+            "vector_db": vector_db,
+            "data_loader": data_loader
         }
     }
 
 
 # FLOW 1: Image Only
 @app.post("/api/flow1/classify")
-async def flow1_classify_upload(file: UploadFile = File(...)):
+async def flow1_classify_upload(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    flow1: Flow1Service = Depends(get_flow1)
+):
     """
     Flow 1: Classify plant from uploaded image
     Returns top-5 predictions with summaries
     """
-    init_services()
-    
+    tmp_path = None
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+        # Save uploaded file temporarily (removed after the response is sent)
+        tmp_path = await save_upload(file)
+        background_tasks.add_task(remove_file, tmp_path)
         
         # Classify
-        result = flow1.classify_and_summarize(image_path=tmp_path)
-        
-        # Cleanup
-        os.unlink(tmp_path)
-        
-        return result
+        return await flow1.classify_and_summarize_async(image_path=tmp_path)
     except Exception as e:
+        # Background tasks are skipped on error responses
+        remove_file(tmp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/flow1/classify-url")
-async def flow1_classify_url(request: ImageURLRequest):
+async def flow1_classify_url(
+    request: ImageURLRequest,
+    flow1: Flow1Service = Depends(get_flow1)
+):
     """
     Flow 1: Classify plant from image URL
     """
-    init_services()
-    
     try:
-        result = flow1.classify_and_summarize(image_url=request.image_url)
+        result = await flow1.classify_and_summarize_async(image_url=request.image_url)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/flow1/detail/{class_name}")
-async def flow1_get_detail(class_name: str):
+async def flow1_get_detail(
+    class_name: str,
+    flow1: Flow1Service = Depends(get_flow1)
+):
     """
     Flow 1: Get detailed plant information
     """
-    init_services()
-    
     try:
         result = flow1.get_plant_detail(class_name)
         return result
@@ -185,45 +297,98 @@ async def flow1_get_detail(class_name: str):
 # FLOW 2: Image + Text Q&A (Two-Step Process)
 
 @app.post("/api/flow2/identify")
-async def flow2_identify(file: UploadFile = File(...)):
+async def flow2_identify(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    flow2: Flow2Service = Depends(get_flow2)
+):
     """
     Flow 2 - Step 1: Identify plant from image only
     Returns predictions for user to select
     """
-    init_services()
-    
+    tmp_path = None
     try:
-        print(f"[Flow2/Identify] File: {file.filename}")
+        log.info("Identify file: %s", file.filename)
         
-        # Save uploaded file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+        # Save uploaded file (removed after the response is sent)
+        tmp_path = await save_upload(file)
+        background_tasks.add_task(remove_file, tmp_path)
         
-        print(f"[Flow2/Identify] Image saved to: {tmp_path}")
+        log.info("Identify image saved to: %s", tmp_path)
         
         # Identify plant only
         result = flow2.identify_plant(image_path=tmp_path, top_k=5)
         
-        print(f"[Flow2/Identify] Found {len(result.get('predictions', []))} predictions")
-        
-        # Cleanup
-        os.unlink(tmp_path)
+        log.info("Identify found %d predictions", len(result.get('predictions', [])))
         
         return result
     except Exception as e:
-        import traceback
-        print(f"[Flow2/Identify ERROR] {type(e).__name__}: {str(e)}")
-        traceback.print_exc()
+        remove_file(tmp_path)
+        log.exception("Identify failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _answer_with_optional_image(
+    question: str,
+    selected_plant: Optional[str],
+    file: Optional[UploadFile],
+    flow2: Flow2Service,
+    background_tasks: BackgroundTasks
+) -> dict:
+    """
+    Shared core of the Flow 2 ask endpoints
+    
+    Answers about selected_plant when given, otherwise identifies the
+    plant from the uploaded file first.
+    """
+    log.info("Ask question: %s", question)
+    log.info("Ask selected plant: %s", selected_plant)
+    log.info("Ask file: %s", file.filename if file else None)
+    
+    # Mode 1: User selected plant (two-step)
+    if selected_plant:
+        result = await flow2.answer_with_plant_async(
+            question=question,
+            plant_class_name=selected_plant,
+            use_rag=True
+        )
+        log.info("Ask answered with selected plant")
+        return result
+    
+    if not file:
+        raise HTTPException(
+            status_code=400,
+            detail="Either 'selected_plant' or 'file' must be provided"
+        )
+    
+    # Mode 2: Legacy one-step (auto-identify from image)
+    tmp_path = None
+    try:
+        # Save uploaded file (removed after the response is sent)
+        tmp_path = await save_upload(file)
+        background_tasks.add_task(remove_file, tmp_path)
+        
+        log.info("Ask image saved to: %s", tmp_path)
+        
+        result = await flow2.answer_question_async(
+            question=question,
+            image_path=tmp_path
+        )
+        
+        log.info("Ask completed one-step flow")
+        return result
+    except Exception:
+        remove_file(tmp_path)
+        raise
+
+
 @app.post("/api/flow2/ask")
 async def flow2_ask_with_plant(
     question: str,
+    background_tasks: BackgroundTasks,
     selected_plant: Optional[str] = None,
-    file: Optional[UploadFile] = File(None)
+    file: Optional[UploadFile] = File(None),
+    flow2: Flow2Service = Depends(get_flow2)
 ):
     """
     Flow 2 - Step 2: Answer question about selected plant
@@ -232,109 +397,43 @@ async def flow2_ask_with_plant(
     1. Two-step: selected_plant provided (after /identify)
     2. One-step: file provided (legacy - auto-identify + answer)
     """
-    init_services()
-    
     try:
-        print(f"[Flow2/Ask] Question: {question}")
-        print(f"[Flow2/Ask] Selected plant: {selected_plant}")
-        print(f"[Flow2/Ask] File: {file.filename if file else None}")
-        
-        # Mode 1: User selected plant (two-step)
-        if selected_plant:
-            result = flow2.answer_with_plant(
-                question=question,
-                plant_class_name=selected_plant,
-                use_rag=True
-            )
-            print(f"[Flow2/Ask] Answered with selected plant")
-            return result
-        
-        # Mode 2: Legacy one-step (auto-identify from image)
-        elif file:
-            # Save uploaded file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-                content = await file.read()
-                tmp.write(content)
-                tmp_path = tmp.name
-            
-            print(f"[Flow2/Ask] Image saved to: {tmp_path}")
-            
-            # One-step answer
-            result = flow2.answer_question(
-                question=question,
-                image_path=tmp_path
-            )
-            
-            print(f"[Flow2/Ask] Completed one-step flow")
-            
-            # Cleanup
-            os.unlink(tmp_path)
-            
-            return result
-        
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Either 'selected_plant' or 'file' must be provided"
-            )
-        
+        return await _answer_with_optional_image(
+            question, selected_plant, file, flow2, background_tasks
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print(f"[Flow2/Ask ERROR] {type(e).__name__}: {str(e)}")
-        traceback.print_exc()
+        log.exception("Ask failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Legacy endpoint - kept for backward compatibility
 @app.post("/api/flow2/ask-legacy")
-async def flow2_ask_upload(question: str, file: UploadFile = File(...)):
+async def flow2_ask_upload(
+    question: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    flow2: Flow2Service = Depends(get_flow2)
+):
     """
     Flow 2: Ask question about plant in uploaded image (legacy one-step)
     """
-    init_services()
-    
-    try:
-        print(f"[Flow2] Received question: {question}")
-        print(f"[Flow2] File: {file.filename}, content_type: {file.content_type}")
-        
-        # Save uploaded file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        print(f"[Flow2] Image saved to: {tmp_path}")
-        
-        # Answer question
-        result = flow2.answer_question(
-            question=question,
-            image_path=tmp_path
-        )
-        
-        print(f"[Flow2] Successfully processed question")
-        
-        # Cleanup
-        os.unlink(tmp_path)
-        
-        return result
-    except Exception as e:
-        import traceback
-        print(f"[Flow2 ERROR] Exception occurred:")
-        print(f"[Flow2 ERROR] Type: {type(e).__name__}")
-        print(f"[Flow2 ERROR] Message: {str(e)}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+    return await flow2_ask_with_plant(
+        question, background_tasks, selected_plant=None, file=file, flow2=flow2
+    )
 
 
 @app.post("/api/flow2/ask-url")
-async def flow2_ask_url(request: Flow2Request):
+async def flow2_ask_url(
+    request: Flow2Request,
+    flow2: Flow2Service = Depends(get_flow2)
+):
     """
     Flow 2: Ask question about plant from image URL
     """
-    init_services()
-    
     try:
-        result = flow2.answer_question(
+        result = await flow2.answer_question_async(
             question=request.question,
             image_url=request.image_url
         )
@@ -344,7 +443,10 @@ async def flow2_ask_url(request: Flow2Request):
 
 
 @app.post("/api/flow3/ask")
-async def flow3_ask(request: Flow3Request):
+async def flow3_ask(
+    request: Flow3Request,
+    flow3: Flow3Service = Depends(get_flow3)
+):
     """
     Flow 3: Pure RAG Q&A with Query Reformulation
     
@@ -353,8 +455,6 @@ async def flow3_ask(request: Flow3Request):
     - Plant context from previous selections
     - Intent detection (chitchat, comparison, specific, generic)
     """
-    init_services()
-    
     try:
         result = flow3.answer_question(
             question=request.question,
@@ -367,24 +467,89 @@ async def flow3_ask(request: Flow3Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _sse(data: str, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event (multi-line data is split per line)"""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+@app.post("/api/flow3/ask-stream")
+async def flow3_ask_stream(
+    request: Flow3Request,
+    flow3: Flow3Service = Depends(get_flow3)
+):
+    """
+    Flow 3 streamed as Server-Sent Events
+    
+    Sends a "meta" event (sources, reformulation) as soon as retrieval is
+    done, then the answer text as it is generated, then a "done" event.
+    """
+    try:
+        result = await run_in_threadpool(
+            flow3.answer_question,
+            question=request.question,
+            top_k=request.top_k,
+            conversation_history=request.conversation_history,
+            selected_plant=request.selected_plant,
+            stream=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    answer_chunks = result.pop("answer")
+    
+    def events():
+        yield _sse(orjson.dumps(result).decode(), event="meta")
+        try:
+            for chunk in answer_chunks:
+                yield _sse(chunk)
+        except Exception as e:
+            yield _sse(str(e), event="error")
+            return
+        yield _sse("", event="done")
+    
+    # Sync generator - Starlette iterates it in a worker thread
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 #GET plant images
+@lru_cache(maxsize=None)
+def _plant_image_paths(class_name: str) -> Tuple[str, ...]:
+    """
+    Sorted static-file URL paths ("plant-images/<class>/<file>") for a plant class
+    
+    Photos are static at runtime and the cache is bounded by the number
+    of plant classes, so it is never evicted.
+    """
+    image_dir = os.path.join(settings.photos_dir, class_name)
+    
+    if not os.path.isdir(image_dir):
+        return ()
+    
+    with os.scandir(image_dir) as entries:
+        names = sorted(entry.name for entry in entries
+                       if entry.name.endswith(".jpg") and not entry.name.startswith("."))
+    return tuple(f"plant-images/{class_name}/{name}" for name in names)
+
+
 @app.get("/api/plants/{class_name}/images")
 async def get_plant_images(class_name: str, request: Request):
     """
     Get all images for a specific plant class
     """
-    image_dir = f"inat_representative_photos/{class_name}"
+    # Unknown classes never reach the filesystem (also rules out "../")
+    if class_name not in request.app.state.image_classes:
+        raise HTTPException(status_code=404, detail=f"Unknown plant class: {class_name}")
     
-    if not os.path.exists(image_dir):
-        return {"class_name": class_name, "image_urls": []}
+    paths = _plant_image_paths(class_name)
     
-    # Get all jpg images
-    images = glob.glob(f"{image_dir}/*.jpg")
-    images.sort()
+    if not paths:
+        return {"class_name": class_name, "image_urls": []}
     
     # Build URLs with dynamic base URL
-    base_url = str(request.base_url).rstrip('/')
-    image_urls = [f"{base_url}/plant-images/{class_name}/{os.path.basename(img)}" for img in images]
+    base_url = str(request.base_url).rstrip('/') + '/'
+    image_urls = [base_url + path for path in paths]
     
     return {
         "class_name": class_name,
@@ -6,36 +6,65 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-import json
-from typing import List, Dict
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import psycopg2
 from tqdm import tqdm
 
 from config import get_settings
 from services.embedding_service import VietnameseEmbeddingService
 from services.vector_db_service import SupabaseVectorDB
+from scripts.flatten_ontology import iter_facts, fact_to_hypernodes
+from utils.pg_copy import copy_hypernodes, content_hash, fetch_content_hashes
+
+
+def _insert_batch(conn, nodes: List[Dict], batch_index: int):
+    """COPY one batch, retrying in smaller chunks on non-duplicate errors"""
+    try:
+        with conn.cursor() as cursor:
+            copy_hypernodes(cursor, nodes)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        error_msg = str(e)
+        # Check if it's a duplicate or other error
+        if "duplicate" in error_msg.lower():
+            print(f"\n⚠️ Skipping batch {batch_index} (duplicates)")
+        else:
+            print(f"\n❌ Error in batch {batch_index}: {error_msg}")
+            print("Retrying with smaller batches...")
+            # Retry in smaller chunks
+            for j in range(0, len(nodes), 10):
+                mini_batch = nodes[j:j+10]
+                try:
+                    with conn.cursor() as cursor:
+                        copy_hypernodes(cursor, mini_batch)
+                    conn.commit()
+                except Exception as e2:
+                    conn.rollback()
+                    print(f"  Failed mini-batch at {j}: {str(e2)[:100]}")
 
 
 def build_and_index_hypergraph(
-    facts_file: str = "plant_facts.json",
-    batch_size: int = 100
+    facts_file: str = "plant_facts.jsonl",
+    batch_size: int = 256
 ):
     """
     Build HyperGraph from facts and index to Supabase
     
+    Inserts go over the direct Postgres connection (SUPABASE_DB_URI) with
+    COPY; the REST client is only used for counting and the test search.
+    
     Args:
-        facts_file: Path to flattened facts JSON
+        facts_file: Path to flattened facts NDJSON
         batch_size: Batch size for embedding and insertion
     """
     print(f"\n{'='*60}")
     print(f"Building HyperGraph and Indexing to Supabase")
     print(f"{'='*60}\n")
     
-    # Load facts
-    print(f"Loading facts from {facts_file}...")
-    with open(facts_file, 'r', encoding='utf-8') as f:
-        facts = json.load(f)
-    print(f"Loaded {len(facts)} facts")
-    
     # Initialize services
     print("\nInitializing services...")
     settings = get_settings()
@@ -44,6 +73,12 @@ def build_and_index_hypergraph(
         url=settings.supabase_url,
         key=settings.supabase_anon_key
     )
+    if not settings.supabase_db_uri:
+        raise ValueError(
+            "SUPABASE_DB_URI not found in environment variables. "
+            "Please set it in your .env file."
+        )
+    conn = psycopg2.connect(dsn=settings.supabase_db_uri)
     
     # Check existing count
     existing_count = vector_db.count_nodes()
@@ -56,73 +91,102 @@ def build_and_index_hypergraph(
             print("✅ Database cleared")
     
     # Build HyperNodes
-    print(f"\nBuilding HyperNodes from facts...")
+    print(f"\nBuilding HyperNodes from {facts_file}...")
     hypernodes = []
     
-    for fact in tqdm(facts, desc="Processing facts"):
-        # Extract plant name and section
-        plant_name = fact.get("Tên", "")
-        section = fact.get("Mục", "")
-        chunk_id = fact.get("_chunk_id", 0)
-        is_chunked = fact.get("_is_chunked", False)
-        
-        # Process each key-value pair (except metadata)
-        for key, value in fact.items():
-            if key.startswith("_") or key in ["Tên", "Mục"]:
-                continue
-            
-            # Create HyperNode data
-            hypernode = {
-                "key": key,
-                "value": str(value),
-                "plant_name": plant_name,
-                "section": section if section else None,
-                "chunk_id": chunk_id,
-                "is_chunked": is_chunked
-            }
-            hypernodes.append(hypernode)
+    for fact in tqdm(iter_facts(facts_file), desc="Processing facts"):
+        hypernodes.extend(fact_to_hypernodes(fact))
     
     print(f"Generated {len(hypernodes)} HyperNodes")
-    
-    # Embed and index in batches
+    total_nodes = len(hypernodes)
+    
+    # Skip nodes that are already indexed so re-runs only embed what changed
+    with conn.cursor() as cursor:
+        existing_hashes = fetch_content_hashes(cursor)
+    conn.commit()
+    hypernodes = [
+        node for node in hypernodes
+        if content_hash(node["plant_name"], node["key"], node["value"]) not in existing_hashes
+    ]
+    print(f"{total_nodes - len(hypernodes)} already indexed, {len(hypernodes)} new")
+    
+    if not hypernodes:
+        conn.close()
+        print("\n✅ Nothing to index - database is up to date")
+        return
+    
+    # Keys come from a small shared vocabulary - embed each unique key once
+    unique_keys = list({node["key"] for node in hypernodes})
+    print(f"\nEmbedding {len(unique_keys)} unique keys...")
+    key_vecs = embed_service.embed_batch(unique_keys, batch_size=256)
+    key_to_vec = dict(zip(unique_keys, key_vecs))
+    
+    # Embed values and index in batches. Embedding runs in a producer thread
+    # so the next batch is encoded while the current one is being inserted.
     print(f"\nEmbedding and indexing (batch size: {batch_size})...")
     
-    for i in tqdm(range(0, len(hypernodes), batch_size), desc="Indexing batches"):
-        batch = hypernodes[i:i+batch_size]
-        
-        # Extract texts for batch embedding
-        keys = [node["key"] for node in batch]
-        values = [node["value"] for node in batch]
-        
-        # Batch embed
-        key_embeddings = embed_service.embed_batch(keys, batch_size=len(keys))
-        value_embeddings = embed_service.embed_batch(values, batch_size=len(values))
-        
-        # Add embeddings to nodes
-        nodes_with_embeddings = []
-        for j, node in enumerate(batch):
-            node["key_embedding"] = key_embeddings[j]
-            node["value_embedding"] = value_embeddings[j]
-            nodes_with_embeddings.append(node)
-        
-        # Batch insert to Supabase
+    batches: "queue.Queue[Optional[List[Dict]]]" = queue.Queue(maxsize=2)
+    # Set when the consumer stops early (error, Ctrl+C): the producer must
+    # not stay blocked on the full queue, or the executor exit hangs
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        """Queue item unless stopped; False if the consumer is gone"""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
         try:
-            vector_db.insert_hypernodes_batch(nodes_with_embeddings)
-        except Exception as e:
-            error_msg = str(e)
-            # Check if it's a duplicate or other error
-            if "duplicate" in error_msg.lower():
-                print(f"\n⚠️ Skipping batch {i//batch_size} (duplicates)")
-            else:
-                print(f"\n❌ Error in batch {i//batch_size}: {error_msg}")
-                print("Retrying with smaller batches...")
-                # Retry in smaller chunks
-                for j in range(0, len(nodes_with_embeddings), 10):
-                    mini_batch = nodes_with_embeddings[j:j+10]
+            for i in range(0, len(hypernodes), batch_size):
+                if stop.is_set():
+                    return
+                batch = hypernodes[i:i+batch_size]
+                
+                # Batch embed values only
+                values = [node["value"] for node in batch]
+                value_embeddings = embed_service.embed_batch(values, batch_size=len(values))
+                
+                # Add embeddings to nodes
+                for j, node in enumerate(batch):
+                    node["key_embedding"] = key_to_vec[node["key"]]
+                    node["value_embedding"] = value_embeddings[j]
+                
+                if not put(batch):
+                    return
+        finally:
+            put(None)  # Sentinel: no more batches
+    
+    num_batches = (len(hypernodes) + batch_size - 1) // batch_size
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            producer = executor.submit(produce)
+            
+            try:
+                with tqdm(total=num_batches, desc="Indexing batches") as progress:
+                    batch_index = 0
+                    while (nodes_with_embeddings := batches.get()) is not None:
+                        _insert_batch(conn, nodes_with_embeddings, batch_index)
+                        batch_index += 1
+                        progress.update(1)
+            finally:
+                # Release the producer (no-op after a normal finish) and drain
+                # what it queued, so the executor exit cannot block on it
+                stop.set()
+                while True:
                     try:
-                        vector_db.insert_hypernodes_batch(mini_batch)
-                    except Exception as e2:
-                        print(f"  Failed mini-batch at {j}: {str(e2)[:100]}")
+                        batches.get_nowait()
+                    except queue.Empty:
+                        break
+            
+            # Re-raise any embedding error from the producer thread
+            producer.result()
+    finally:
+        conn.close()
     
     # Final statistics
     final_count = vector_db.count_nodes()
@@ -131,8 +195,8 @@ def build_and_index_hypergraph(
     print(f"INDEXING COMPLETE")
     print(f"{'='*60}")
     print(f"Total HyperNodes indexed: {final_count}")
-    print(f"Expected: {len(hypernodes)}")
-    print(f"Success rate: {final_count/len(hypernodes)*100:.1f}%")
+    print(f"Expected: {total_nodes}")
+    print(f"Success rate: {final_count/total_nodes*100:.1f}%")
     print(f"{'='*60}\n")
     
     # Test search
@@ -154,8 +218,8 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Build and index HyperGraph")
-    parser.add_argument("--facts", default="plant_facts.json", help="Path to facts JSON")
-    parser.add_argument("--batch-size", type=int, default=100, help="Batch size")
+    parser.add_argument("--facts", default="plant_facts.jsonl", help="Path to facts NDJSON")
+    parser.add_argument("--batch-size", type=int, default=256, help="Batch size")
     
     args = parser.parse_args()
     
@@ -1,105 +1,124 @@
 """
 Clean Duplicate Nodes from Supabase
-Memory-efficient approach using batches
+Deduplicates server-side in a single SQL statement over the direct DB connection
 """
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import psycopg2
+
 from config import get_settings
-from services.vector_db_service import SupabaseVectorDB
-from tqdm import tqdm
 
 
-def clean_duplicates():
-    """Clean duplicate nodes efficiently"""
+# Keep the lowest id of each (key, value, plant_name) group
+COUNT_DUPLICATES_SQL = """
+    SELECT COUNT(*) FROM (
+        SELECT ROW_NUMBER() OVER (
+            PARTITION BY key, value, plant_name ORDER BY id
+        ) AS rn
+        FROM hypernodes
+    ) t
+    WHERE rn > 1
+"""
+
+LIST_DUPLICATES_SQL = """
+    SELECT id, plant_name, key FROM (
+        SELECT id, plant_name, key, ROW_NUMBER() OVER (
+            PARTITION BY key, value, plant_name ORDER BY id
+        ) AS rn
+        FROM hypernodes
+    ) t
+    WHERE rn > 1
+    ORDER BY plant_name, key, id
+"""
+
+DELETE_DUPLICATES_SQL = """
+    DELETE FROM hypernodes
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY key, value, plant_name ORDER BY id
+            ) AS rn
+            FROM hypernodes
+        ) t
+        WHERE rn > 1
+    )
+"""
+
+
+def list_duplicates(conn):
+    """Stream duplicate rows through a server-side cursor"""
+    with conn.cursor(name="dedup_cursor") as cursor:
+        cursor.itersize = 10000
+        cursor.execute(LIST_DUPLICATES_SQL)
+        for node_id, plant_name, key in cursor:
+            print(f"  [{node_id}] {plant_name} - {key}")
+
+
+def clean_duplicates(show: bool = False):
+    """
+    Clean duplicate nodes efficiently
+    
+    Args:
+        show: Print every duplicate row before asking for confirmation
+    """
     print("\n" + "="*60)
     print("Cleaning Duplicate Nodes")
     print("="*60 + "\n")
     
-    # Initialize
     settings = get_settings()
-    vector_db = SupabaseVectorDB(
-        url=settings.supabase_url,
-        key=settings.supabase_anon_key
-    )
-    
-    # Check current count
-    initial_count = vector_db.count_nodes()
-    print(f"Current node count: {initial_count}")
-    
-    # Get all nodes using pagination
-    print("\nFetching all nodes (this may take a while)...")
-    all_nodes_data = []
-    page_size = 1000
-    offset = 0
+    if not settings.supabase_db_uri:
+        raise ValueError(
+            "SUPABASE_DB_URI not found in environment variables. "
+            "Please set it in your .env file."
+        )
     
-    while True:
-        batch = vector_db.client.table('hypernodes')\
-            .select('id, key, value, plant_name')\
-            .range(offset, offset + page_size - 1)\
-            .execute()
+    conn = psycopg2.connect(dsn=settings.supabase_db_uri)
+    try:
+        cursor = conn.cursor()
         
-        if not batch.data:
-            break
+        # Check current count
+        cursor.execute("SELECT COUNT(*) FROM hypernodes")
+        initial_count = cursor.fetchone()[0]
+        print(f"Current node count: {initial_count}")
         
-        all_nodes_data.extend(batch.data)
-        offset += page_size
-        print(f"  Fetched {len(all_nodes_data)} nodes so far...")
-    
-    nodes = all_nodes_data
-    print(f"\nTotal fetched: {len(nodes)} nodes")
-    
-    # Find duplicates
-    print("\nIdentifying duplicates...")
-    seen = {}
-    duplicates_to_delete = []
-    
-    for node in tqdm(nodes, desc="Processing nodes"):
-        key_tuple = (node['key'], node['value'], node['plant_name'])
+        # Find duplicates
+        print("\nIdentifying duplicates...")
+        cursor.execute(COUNT_DUPLICATES_SQL)
+        duplicate_count = cursor.fetchone()[0]
         
-        if key_tuple in seen:
-            # This is a duplicate, mark for deletion
-            # Keep the one with lower ID
-            if node['id'] > seen[key_tuple]['id']:
-                duplicates_to_delete.append(node['id'])
-            else:
-                duplicates_to_delete.append(seen[key_tuple]['id'])
-                seen[key_tuple] = node
-        else:
-            seen[key_tuple] = node
-    
-    print(f"\nFound {len(duplicates_to_delete)} duplicate nodes to delete")
-    
-    if len(duplicates_to_delete) == 0:
-        print("✅ No duplicates found!")
-        return
-    
-    # Confirm deletion
-    response = input(f"\nDelete {len(duplicates_to_delete)} duplicate nodes? (yes/no): ")
-    if response.lower() != 'yes':
-        print("Cancelled")
-        return
-    
-    # Delete in batches
-    batch_size = 100
-    deleted_count = 0
-    
-    print(f"\nDeleting duplicates in batches of {batch_size}...")
-    for i in tqdm(range(0, len(duplicates_to_delete), batch_size), desc="Deleting batches"):
-        batch = duplicates_to_delete[i:i+batch_size]
+        print(f"\nFound {duplicate_count} duplicate nodes to delete")
         
-        try:
-            vector_db.client.table('hypernodes')\
-                .delete()\
-                .in_('id', batch)\
-                .execute()
-            deleted_count += len(batch)
-        except Exception as e:
-            print(f"\nError deleting batch at index {i}: {e}")
+        if duplicate_count == 0:
+            print("✅ No duplicates found!")
+            return
+        
+        if show:
+            list_duplicates(conn)
+        
+        # Confirm deletion
+        response = input(f"\nDelete {duplicate_count} duplicate nodes? (yes/no): ")
+        if response.lower() != 'yes':
+            print("Cancelled")
+            return
+        
+        print("\nDeleting duplicates...")
+        cursor.execute(DELETE_DUPLICATES_SQL)
+        deleted_count = cursor.rowcount
+        conn.commit()
+        
+        # Final count
+        cursor.execute("SELECT COUNT(*) FROM hypernodes")
+        final_count = cursor.fetchone()[0]
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    # Final count
-    final_count = vector_db.count_nodes()
+    expected = initial_count - duplicate_count
     
     print(f"\n{'='*60}")
     print("CLEANUP COMPLETE")
@@ -107,14 +126,21 @@ def clean_duplicates():
     print(f"Initial nodes: {initial_count}")
     print(f"Deleted duplicates: {deleted_count}")
     print(f"Final nodes: {final_count}")
-    print(f"Expected: {len(seen)}")
+    print(f"Expected: {expected}")
     print(f"{'='*60}\n")
     
-    if final_count == len(seen):
+    if final_count == expected:
         print("✅ Cleanup successful!")
     else:
         print("⚠️ Final count doesn't match expected. May need to run again.")
 
 
 if __name__ == "__main__":
-    clean_duplicates()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Remove duplicate hypernodes")
+    parser.add_argument("--show", action="store_true", help="List duplicate rows before deleting")
+    
+    args = parser.parse_args()
+    
+    clean_duplicates(args.show)
@@ -7,6 +7,9 @@ from pathlib import Path
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import psycopg2
+import psycopg2.errors
+
 from services.vector_db_service import SupabaseVectorDB
 from config import get_settings
 
@@ -32,32 +35,32 @@ def main():
         print("Cancelled.")
         return
     
-    print("\nClearing nodes in batches (to avoid timeout)...")
+    if not settings.supabase_db_uri:
+        raise ValueError(
+            "SUPABASE_DB_URI not found in environment variables. "
+            "Please set it in your .env file."
+        )
     
-    batch_size = 100
-    deleted_total = 0
+    print("\nClearing nodes...")
     
-    while True:
-        # Delete first 100 nodes
+    conn = psycopg2.connect(dsn=settings.supabase_db_uri)
+    try:
+        cursor = conn.cursor()
         try:
-            result = vector_db.client.table('hypernodes')\
-                .delete()\
-                .limit(batch_size)\
-                .execute()
-            
-            deleted = len(result.data) if result.data else 0
-            
-            if deleted == 0:
-                break
-            
-            deleted_total += deleted
-            print(f"  Deleted {deleted} nodes (total: {deleted_total}/{count})")
-            
-        except Exception as e:
-            print(f"Error: {e}")
-            break
+            cursor.execute("TRUNCATE TABLE hypernodes")
+        except psycopg2.errors.FeatureNotSupported:
+            # Referenced by a foreign key - fall back to a single DELETE
+            conn.rollback()
+            cursor.execute("DELETE FROM hypernodes")
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    print(f"\n✅ Deleted {deleted_total} nodes")
+    print(f"\n✅ Deleted {count} nodes")
     
     # Verify
     new_count = vector_db.count_nodes()
@@ -5,11 +5,15 @@ Fast import using CORRECT Supabase Connection URI (Tokyo Region)
 import sys
 import json
 import os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 import psycopg2
-from psycopg2.extras import execute_values
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from utils.pg_copy import copy_hypernodes, drop_vector_indexes, create_vector_indexes
+
 # Load environment variables
 load_dotenv()
 
@@ -27,7 +31,8 @@ if not CONNECTION_URI:
 
 def import_with_psycopg2(
     embeddings_file="plant_hypernodes_with_embeddings.json",
-    batch_size=1000
+    batch_size=1000,
+    rebuild_index=False
 ):
     print(f"\n{'='*60}")
     print(f"Fast Import via Supabase Pooler (Tokyo Region)")
@@ -59,44 +64,38 @@ def import_with_psycopg2(
 
         if existing_count > 0:
             print(f"⚠️  Warning: Database has {existing_count} existing nodes")
-            print("Clearing existing data...")
+            print("Clearing existing data (committed together with the import)...")
             cursor.execute("TRUNCATE TABLE hypernodes")
-            conn.commit()
             print("✅ Cleared\n")
 
-        # 3. Insert batches
-        print(f"Inserting {len(hypernodes)} nodes in batches of {batch_size}...")
-
-        insert_query = """
-            INSERT INTO hypernodes (key, value, plant_name, section, key_embedding, value_embedding)
-            VALUES %s
-        """
-
-        for i in tqdm(range(0, len(hypernodes), batch_size), desc="Inserting"):
-            batch = hypernodes[i : i + batch_size]
-            values = [
-                (
-                    node["key"],
-                    node["value"],
-                    node["plant_name"],
-                    node.get("section"),
-                    node["key_embedding"],
-                    node["value_embedding"],
-                )
-                for node in batch
-            ]
-
-            try:
-                execute_values(cursor, insert_query, values)
-                conn.commit()
-            except Exception as e:
-                print(f"\n❌ Error in batch {i//batch_size}: {e}")
-                conn.rollback()
+        if rebuild_index:
+            print("Dropping vector indexes for bulk load...")
+            drop_vector_indexes(cursor)
+
+        # 3. Stream batches through COPY in a single transaction
+        print(f"Copying {len(hypernodes)} nodes in batches of {batch_size}...")
+
+        try:
+            for i in tqdm(range(0, len(hypernodes), batch_size), desc="Copying"):
+                batch = hypernodes[i : i + batch_size]
+                copy_hypernodes(cursor, batch)
+            conn.commit()
+        except Exception:
+            # Roll the whole load back (including TRUNCATE) so it can simply be re-run
+            conn.rollback()
+            print("\n❌ Import failed, all changes rolled back")
+            raise
 
         # Final verify
         cursor.execute("SELECT COUNT(*) FROM hypernodes")
         final_count = cursor.fetchone()[0]
 
+        if rebuild_index:
+            print("\nRebuilding vector indexes...")
+            create_vector_indexes(cursor)
+            conn.commit()
+            print("✅ Indexes rebuilt")
+
         cursor.close()
         conn.close()
 
@@ -116,6 +115,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--embeddings", default="plant_hypernodes_with_embeddings.json")
     parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Drop HNSW indexes before loading and rebuild them afterwards")
     args = parser.parse_args()
 
-    import_with_psycopg2(args.embeddings, args.batch_size)
\ No newline at end of file
+    import_with_psycopg2(args.embeddings, args.batch_size, args.rebuild_index)
\ No newline at end of file
@@ -3,21 +3,34 @@ Ontology Flattener
 Converts hierarchical JSON-LD plant data to flat fact lists for OG-RAG HyperGraph
 """
 import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from typing import List, Dict, Any
-import json
-from utils.key_normalizer import normalize_key
-from utils.chunker import chunk_long_value, estimate_tokens
-from utils.data_loader import PlantDataLoader
+from typing import List, Dict, Any, Iterator
+import orjson
+from utils.key_normalizer import normalize_keys_batch
+from utils.chunker import chunk_long_value, count_tokens_batch, fits_tokens
+from utils.data_loader import load_jsonld_file
+
+
+# Sections flattened into facts, with their normalized names precomputed
+_SECTIONS = (
+    "Mô tả", "Phân bố",
+    "Công dụng", "Cách dùng", "Bộ phận dùng",
+    "Thông tin khác"
+)
+_SECTION_NORMALIZED = dict(zip(_SECTIONS, normalize_keys_batch(_SECTIONS)))
 
 
 def flatten_plant_ontology(
     plant_data: Dict[str, Any],
-    chunk_threshold: int = 250
+    chunk_threshold: int = 250,
+    use_tokenizer: bool = False
 ) -> List[Dict[str, Any]]:
     """
     Convert nested JSON-LD to flat fact list with intelligent chunking
@@ -25,6 +38,8 @@ def flatten_plant_ontology(
     Args:
         plant_data: Nested plant ontology data
         chunk_threshold: Maximum tokens before chunking (default: 250)
+        use_tokenizer: Decide chunking with the embedding model's tokenizer
+            instead of the word-count estimate
         
     Returns:
         List of flat facts suitable for HyperGraph
@@ -47,14 +62,9 @@ def flatten_plant_ontology(
         basic_fact["_is_chunked"] = False
         facts.append(basic_fact)
     
-    # 2. Process each section
-    sections = [
-        "Mô tả", "Phân bố", 
-        "Công dụng", "Cách dùng", "Bộ phận dùng",
-        "Thông tin khác"
-    ]
-    
-    for section in sections:
+    # 2. Collect every field of every section
+    fields = []
+    for section, section_key in _SECTION_NORMALIZED.items():
         if section not in plant_data:
             continue
         
@@ -63,125 +73,190 @@ def flatten_plant_ontology(
         if not isinstance(section_data, dict):
             continue
         
-        # Process each field in section
-        for field_key, field_value in section_data.items():
-            if not field_value or field_value == "":
-                continue
-            
-            # Normalize key to Vietnamese
-            normalized_key = normalize_key(field_key)
-            
-            # Convert to string
-            value_str = str(field_value)
+        section_fields = [(field_key, field_value) for field_key, field_value in section_data.items()
+                          if field_value and field_value != ""]
+        
+        # Normalize keys to Vietnamese (whole section at once), values to string
+        normalized_keys = normalize_keys_batch([field_key for field_key, _ in section_fields])
+        fields.extend(
+            (section_key, normalized_key, str(field_value))
+            for normalized_key, (_, field_value) in zip(normalized_keys, section_fields)
+        )
+    
+    # 3. Decide which values need chunking (one tokenizer call per plant)
+    if use_tokenizer:
+        token_counts = count_tokens_batch([value_str for _, _, value_str in fields])
+        needs_chunking = [count > chunk_threshold for count in token_counts]
+    else:
+        # Short values skip token counting
+        needs_chunking = [not fits_tokens(value_str, chunk_threshold) for _, _, value_str in fields]
+    
+    for (section_key, normalized_key, value_str), chunk in zip(fields, needs_chunking):
+        if chunk:
+            # CHUNK IT!
+            # Chunks are sized with the same counter that decided to chunk
+            chunks = chunk_long_value(
+                normalized_key,
+                value_str,
+                max_tokens=chunk_threshold,
+                token_counter=count_tokens_batch if use_tokenizer else None
+            )
             
-            # Check if chunking needed
-            if estimate_tokens(value_str) > chunk_threshold:
-                # CHUNK IT!
-                chunks = chunk_long_value(
-                    normalized_key,
-                    value_str,
-                    max_tokens=chunk_threshold
-                )
-                
-                for chunk_key, chunk_value, chunk_id in chunks:
-                    fact = {
-                        "Tên": plant_name,
-                        "Mục": normalize_key(section),
-                        chunk_key: chunk_value,
-                        "_chunk_id": chunk_id,
-                        "_is_chunked": True
-                    }
-                    facts.append(fact)
-            else:
-                # No chunking needed
+            for chunk_key, chunk_value, chunk_id in chunks:
                 fact = {
                     "Tên": plant_name,
-                    "Mục": normalize_key(section),
-                    normalized_key: value_str,
-                    "_is_chunked": False
+                    "Mục": section_key,
+                    chunk_key: chunk_value,
+                    "_chunk_id": chunk_id,
+                    "_is_chunked": True
                 }
                 facts.append(fact)
+        else:
+            # No chunking needed
+            fact = {
+                "Tên": plant_name,
+                "Mục": section_key,
+                normalized_key: value_str,
+                "_is_chunked": False
+            }
+            facts.append(fact)
     
     return facts
 
 
+def flatten_file(
+    jsonld_file: Path,
+    chunk_threshold: int = 250,
+    use_tokenizer: bool = False
+) -> List[Dict[str, Any]]:
+    """Load and flatten a single plant file (runs in a worker process)"""
+    plant_data = load_jsonld_file(jsonld_file)
+    if not plant_data:
+        return []
+    return flatten_plant_ontology(plant_data, chunk_threshold, use_tokenizer)
+
+
 def build_all_plant_facts(
     data_dir: str = "data",
-    output_file: str = "plant_facts.json",
-    chunk_threshold: int = 250
-) -> List[Dict]:
+    output_file: str = "plant_facts.jsonl",
+    chunk_threshold: int = 250,
+    use_tokenizer: bool = False
+) -> int:
     """
-    Process all plants and generate flat facts
+    Process all plants and stream flat facts to an NDJSON file
+    
+    Files are flattened in parallel worker processes; each plant's facts
+    are written as soon as they come back (one JSON object per line), so
+    memory stays flat regardless of corpus size.
     
     Args:
         data_dir: Directory containing JSON-LD files
-        output_file: Output file for facts (optional)
+        output_file: Output NDJSON file for facts
         chunk_threshold: Token threshold for chunking
+        use_tokenizer: Count tokens with the embedding model's tokenizer
         
     Returns:
-        List of all facts from all plants
+        Number of facts written
     """
     from tqdm import tqdm
     
-    loader = PlantDataLoader(data_dir)
-    all_facts = []
+    total_facts = 0
+    chunked_facts = 0
+    section_counts = {}
     
     jsonld_files = sorted(Path(data_dir).glob("ontology_node_*.jsonld"))
     
-    print(f"\nProcessing {len(jsonld_files)} plant files...")
+    print(f"\nProcessing {len(jsonld_files)} plant files -> {output_file}...")
     
-    for jsonld_file in tqdm(jsonld_files, desc="Flattening plants"):
-        # Load plant data
-        plant_data = loader._load_jsonld_file(jsonld_file)
-        
-        if not plant_data:
-            continue
-        
-        # Flatten + chunk
-        plant_facts = flatten_plant_ontology(plant_data, chunk_threshold)
-        all_facts.extend(plant_facts)
-    
-    # Save if output file specified
-    if output_file:
-        print(f"\nSaving {len(all_facts)} facts to {output_file}...")
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(all_facts, f, ensure_ascii=False, indent=2)
+    # Files are independent - flatten them across all cores
+    process_one = partial(flatten_file, chunk_threshold=chunk_threshold, use_tokenizer=use_tokenizer)
+    with open(output_file, "wb") as out, \
+            ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(process_one, jsonld_files, chunksize=8)
+        for plant_facts in tqdm(results, total=len(jsonld_files), desc="Flattening plants"):
+            # Write each plant's facts as soon as they arrive (in file order)
+            for fact in plant_facts:
+                out.write(orjson.dumps(fact))
+                out.write(b"\n")
+                
+                total_facts += 1
+                if fact.get("_is_chunked", False):
+                    chunked_facts += 1
+                if "Mục" in fact:
+                    section_counts[fact["Mục"]] = section_counts.get(fact["Mục"], 0) + 1
     
     # Print statistics
     print(f"\n{'='*60}")
     print(f"STATISTICS")
     print(f"{'='*60}")
     print(f"Total plants processed: {len(jsonld_files)}")
-    print(f"Total facts generated: {len(all_facts)}")
-    print(f"Avg facts per plant: {len(all_facts) / len(jsonld_files):.1f}")
+    print(f"Total facts generated: {total_facts}")
+    print(f"Avg facts per plant: {total_facts / max(len(jsonld_files), 1):.1f}")
     
-    chunked = [f for f in all_facts if f.get("_is_chunked", False)]
-    print(f"Chunked facts: {len(chunked)} ({len(chunked)/len(all_facts)*100:.1f}%)")
-    print(f"Unchunked facts: {len(all_facts) - len(chunked)}")
+    print(f"Chunked facts: {chunked_facts} ({chunked_facts/max(total_facts, 1)*100:.1f}%)")
+    print(f"Unchunked facts: {total_facts - chunked_facts}")
     
     # Section coverage
-    sections = [f.get("Mục") for f in all_facts if "Mục" in f]
-    section_counts = {}
-    for section in sections:
-        section_counts[section] = section_counts.get(section, 0) + 1
-    
     print(f"\nSection coverage:")
     for section, count in sorted(section_counts.items(), key=lambda x: -x[1]):
         print(f"  {section}: {count}")
     
     print(f"{'='*60}\n")
     
-    return all_facts
+    return total_facts
+
+
+def fact_to_hypernodes(fact: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn one flat fact into HyperNode rows (one per key-value pair)
+    
+    Args:
+        fact: Fact from flatten_plant_ontology
+        
+    Returns:
+        HyperNode dicts without embeddings
+    """
+    # Extract plant name and section
+    plant_name = fact.get("Tên", "")
+    section = fact.get("Mục", "")
+    chunk_id = fact.get("_chunk_id", 0)
+    is_chunked = fact.get("_is_chunked", False)
+    
+    # Process each key-value pair (except metadata)
+    return [
+        {
+            "key": key,
+            "value": str(value),
+            "plant_name": plant_name,
+            "section": section if section else None,
+            "chunk_id": chunk_id,
+            "is_chunked": is_chunked
+        }
+        for key, value in fact.items()
+        if not key.startswith("_") and key not in ("Tên", "Mục")
+    ]
+
+
+def iter_facts(facts_file: str) -> Iterator[Dict[str, Any]]:
+    """Read facts back one at a time from an NDJSON file"""
+    with open(facts_file, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Flatten JSON-LD plants to NDJSON facts")
+    parser.add_argument("data_dir", nargs="?", default="data", help="Directory with JSON-LD files")
+    parser.add_argument("output_file", nargs="?", default="plant_facts.jsonl", help="Output NDJSON file")
+    parser.add_argument("--tokenizer", action="store_true",
+                        help="Count tokens with the embedding model's tokenizer")
     
-    # Allow optional arguments
-    data_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "plant_facts.json"
+    args = parser.parse_args()
     
-    facts = build_all_plant_facts(data_dir, output_file)
+    num_facts = build_all_plant_facts(args.data_dir, args.output_file, use_tokenizer=args.tokenizer)
     
-    print(f"✅ Done! Generated {len(facts)} facts")
-    print(f"📄 Saved to {output_file}")
+    print(f"✅ Done! Generated {num_facts} facts")
+    print(f"📄 Saved to {args.output_file}")
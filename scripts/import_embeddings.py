@@ -6,14 +6,42 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import asyncio
 import json
+import orjson
 import numpy as np
+from typing import List, Dict
 from tqdm import tqdm
 
 from config import get_settings
 from services.vector_db_service import SupabaseVectorDB
 
 
+def fill_missing_embeddings(hypernodes: List[Dict], batch_size: int = 256):
+    """
+    Embed keys and values for nodes that have no embeddings yet
+    
+    All missing values are encoded in one batched call, then written
+    back onto the nodes; keys repeat across plants, so each distinct key
+    is encoded once (embedding cache).
+    """
+    missing = [node for node in hypernodes
+               if node.get("key_embedding") is None or node.get("value_embedding") is None]
+    if not missing:
+        return
+    
+    from services.embedding_service import get_embedding_service
+    
+    print(f"\nEmbedding {len(missing)} nodes without embeddings...")
+    embed_service = get_embedding_service()
+    key_vecs = embed_service.embed_queries([node["key"] for node in missing])
+    value_vecs = embed_service.embed_many([node["value"] for node in missing], batch_size=batch_size)
+    
+    for node, key_vec, value_vec in zip(missing, key_vecs, value_vecs):
+        node["key_embedding"] = key_vec
+        node["value_embedding"] = value_vec
+
+
 def import_embeddings_from_json(
     embeddings_file: str = "plant_hypernodes_with_embeddings.json",
     batch_size: int = 200
@@ -22,7 +50,7 @@ def import_embeddings_from_json(
     Import pre-generated embeddings from JSON file
     
     Args:
-        embeddings_file: Path to JSON file with HyperNodes + embeddings
+        embeddings_file: Path to JSON (or .jsonl NDJSON) file with HyperNodes + embeddings
         batch_size: Batch size for insertion
     """
     print(f"\n{'='*60}")
@@ -31,11 +59,72 @@ def import_embeddings_from_json(
     
     # Load hypernodes with embeddings
     print(f"Loading {embeddings_file}...")
-    with open(embeddings_file, 'r', encoding='utf-8') as f:
-        hypernodes = json.load(f)
+    if embeddings_file.endswith(".jsonl"):
+        # NDJSON: one HyperNode per line
+        with open(embeddings_file, 'rb') as f:
+            hypernodes = [orjson.loads(line) for line in f if line.strip()]
+    else:
+        with open(embeddings_file, 'r', encoding='utf-8') as f:
+            hypernodes = json.load(f)
     
     print(f"Loaded {len(hypernodes)} HyperNodes with embeddings")
     
+    fill_missing_embeddings(hypernodes)
+    
+    insert_hypernodes(hypernodes, batch_size)
+
+
+async def _insert_batches(
+    vector_db: SupabaseVectorDB,
+    hypernodes: List[Dict],
+    batch_size: int,
+    concurrency: int
+):
+    """Insert all batches with at most `concurrency` requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    num_batches = (len(hypernodes) + batch_size - 1) // batch_size
+    
+    async with vector_db.async_rest_client() as client:
+        with tqdm(total=num_batches, desc="Inserting batches") as progress:
+            
+            async def insert_batch(batch_index: int, batch: List[Dict]):
+                async with semaphore:
+                    try:
+                        await vector_db.insert_hypernodes_batch_async(client, batch)
+                    except Exception as e:
+                        error_msg = str(e)
+                        if "duplicate" in error_msg.lower():
+                            print(f"\n⚠️ Skipping batch {batch_index} (duplicates)")
+                        else:
+                            print(f"\n❌ Error in batch {batch_index}: {error_msg}")
+                            print("Retrying with smaller batches...")
+                            # Retry in smaller chunks
+                            for j in range(0, len(batch), 10):
+                                mini_batch = batch[j:j+10]
+                                try:
+                                    await vector_db.insert_hypernodes_batch_async(client, mini_batch)
+                                except Exception as e2:
+                                    print(f"  Failed mini-batch at {j}: {str(e2)[:100]}")
+                progress.update(1)
+            
+            await asyncio.gather(*(
+                insert_batch(i // batch_size, hypernodes[i:i+batch_size])
+                for i in range(0, len(hypernodes), batch_size)
+            ))
+
+
+def insert_hypernodes(hypernodes: List[Dict], batch_size: int = 200, concurrency: int = 8):
+    """
+    Insert HyperNodes with embeddings into Supabase in batches
+    
+    Embeddings may be lists or NumPy arrays; arrays are converted at the
+    HTTP boundary by SupabaseVectorDB.
+    
+    Args:
+        hypernodes: Nodes with key_embedding / value_embedding
+        batch_size: Batch size for insertion
+        concurrency: Number of insert requests in flight
+    """
     # Initialize Supabase
     print("\nConnecting to Supabase...")
     settings = get_settings()
@@ -54,28 +143,11 @@ def import_embeddings_from_json(
             vector_db.clear_all_nodes()
             print("✅ Database cleared")
     
-    # Insert in batches
-    print(f"\nInserting {len(hypernodes)} nodes (batch size: {batch_size})...")
-    
-    for i in tqdm(range(0, len(hypernodes), batch_size), desc="Inserting batches"):
-        batch = hypernodes[i:i+batch_size]
-        
-        try:
-            vector_db.insert_hypernodes_batch(batch)
-        except Exception as e:
-            error_msg = str(e)
-            if "duplicate" in error_msg.lower():
-                print(f"\n⚠️ Skipping batch {i//batch_size} (duplicates)")
-            else:
-                print(f"\n❌ Error in batch {i//batch_size}: {error_msg}")
-                print("Retrying with smaller batches...")
-                # Retry in smaller chunks
-                for j in range(0, len(batch), 10):
-                    mini_batch = batch[j:j+10]
-                    try:
-                        vector_db.insert_hypernodes_batch(mini_batch)
-                    except Exception as e2:
-                        print(f"  Failed mini-batch at {j}: {str(e2)[:100]}")
+    # Insert in batches, several requests in flight at once
+    print(f"\nInserting {len(hypernodes)} nodes "
+          f"(batch size: {batch_size}, concurrency: {concurrency})...")
+    
+    asyncio.run(_insert_batches(vector_db, hypernodes, batch_size, concurrency))
     
     # Final statistics
     final_count = vector_db.count_nodes()
@@ -99,8 +171,12 @@ def import_embeddings_from_npz(
     """
     Import from compressed NumPy format
     
+    A directory holding key_embeddings.npy and value_embeddings.npy (e.g.
+    `unzip plant_embeddings.npz -d plant_embeddings/`) is memory-mapped
+    instead of decompressed into RAM.
+    
     Args:
-        embeddings_file: Path to .npz file with embeddings
+        embeddings_file: Path to .npz file, or directory of .npy files, with embeddings
         metadata_file: Path to JSON file with node metadata
         batch_size: Batch size for insertion
     """
@@ -110,9 +186,14 @@ def import_embeddings_from_npz(
     
     # Load embeddings
     print(f"Loading {embeddings_file}...")
-    data = np.load(embeddings_file)
-    key_embeddings = data['key_embeddings']
-    value_embeddings = data['value_embeddings']
+    if Path(embeddings_file).is_dir():
+        # Unzipped .npz: memory-map the .npy members, pages load on demand
+        key_embeddings = np.load(Path(embeddings_file) / "key_embeddings.npy", mmap_mode='r')
+        value_embeddings = np.load(Path(embeddings_file) / "value_embeddings.npy", mmap_mode='r')
+    else:
+        data = np.load(embeddings_file)
+        key_embeddings = data['key_embeddings']
+        value_embeddings = data['value_embeddings']
     
     print(f"Loaded embeddings:")
     print(f"  Keys: {key_embeddings.shape}")
@@ -125,18 +206,17 @@ def import_embeddings_from_npz(
     
     print(f"Loaded {len(metadata)} metadata entries")
     
-    # Combine
+    # Combine - rows stay ndarray views until the insert serializes them
     hypernodes = []
     for i, meta in enumerate(metadata):
         node = meta.copy()
-        node['key_embedding'] = key_embeddings[i].tolist()
-        node['value_embedding'] = value_embeddings[i].tolist()
+        node['key_embedding'] = key_embeddings[i]
+        node['value_embedding'] = value_embeddings[i]
         hypernodes.append(node)
     
     print(f"Combined into {len(hypernodes)} HyperNodes\n")
     
-    # Use JSON import function
-    import_embeddings_from_json.__wrapped__(hypernodes, batch_size)
+    insert_hypernodes(hypernodes, batch_size)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""
+Streaming Ingest Pipeline
+Flattens JSON-LD plants, embeds and inserts HyperNodes in one pass without intermediate files
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Dict, Optional, Set
+
+from config import get_settings
+from services.embedding_service import get_embedding_service
+from services.vector_db_service import SupabaseVectorDB
+from scripts.flatten_ontology import flatten_file, fact_to_hypernodes
+from utils.pg_copy import content_hash
+
+
+def _flatten_stage(
+    loop: asyncio.AbstractEventLoop,
+    out: "asyncio.Queue[Optional[List[Dict]]]",
+    jsonld_files: List[Path],
+    batch_size: int,
+    chunk_threshold: int,
+    seen_hashes: Set[str],
+    stop: threading.Event
+):
+    """
+    Flatten plant files across processes and emit HyperNode batches (runs in a thread)
+    
+    Nodes whose content hash is in seen_hashes (already stored, or emitted
+    earlier in this run) are dropped before they reach the embed stage.
+    Returns early once stop is set.
+    """
+    def put(batch) -> bool:
+        """Queue batch unless stopped; False if the pipeline is shutting down"""
+        future = asyncio.run_coroutine_threadsafe(out.put(batch), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+    
+    buffer = []
+    try:
+        process_one = partial(flatten_file, chunk_threshold=chunk_threshold)
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for plant_facts in executor.map(process_one, jsonld_files, chunksize=8):
+                if stop.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                for fact in plant_facts:
+                    for node in fact_to_hypernodes(fact):
+                        node_hash = content_hash(node["plant_name"], node["key"], node["value"])
+                        if node_hash not in seen_hashes:
+                            seen_hashes.add(node_hash)
+                            buffer.append(node)
+                while len(buffer) >= batch_size:
+                    if not put(buffer[:batch_size]):
+                        return
+                    buffer = buffer[batch_size:]
+        if buffer:
+            put(buffer)
+    finally:
+        put(None)  # Sentinel: no more batches
+
+
+async def _embed_stage(
+    embed_service,
+    inp: "asyncio.Queue[Optional[List[Dict]]]",
+    out: "asyncio.Queue[Optional[List[Dict]]]"
+):
+    """Embed keys and values of each batch (values in a single encode call)"""
+    while (batch := await inp.get()) is not None:
+        # Keys are a small set of field names repeated for every plant:
+        # the embedding cache encodes each one once per run
+        key_vectors = await asyncio.to_thread(
+            embed_service.embed_queries, [node["key"] for node in batch]
+        )
+        values = [node["value"] for node in batch]
+        value_vectors = await asyncio.to_thread(
+            embed_service.embed_many, values, len(values), False
+        )
+        for node, key_vector, value_vector in zip(batch, key_vectors, value_vectors):
+            node["key_embedding"] = key_vector
+            node["value_embedding"] = value_vector
+        await out.put(batch)
+    # Sentinel only on success: on failure run_pipeline cancels the insert stage
+    await out.put(None)
+
+
+async def _insert_stage(
+    vector_db: SupabaseVectorDB,
+    inp: "asyncio.Queue[Optional[List[Dict]]]",
+    concurrency: int
+) -> int:
+    """Insert embedded batches with up to `concurrency` requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    inserted = 0
+    
+    async def insert_batch(client, batch_index: int, batch: List[Dict]):
+        nonlocal inserted
+        try:
+            await vector_db.insert_hypernodes_batch_async(client, batch)
+            inserted += len(batch)
+        except Exception as e:
+            print(f"\n❌ Error in batch {batch_index}: {str(e)[:200]}")
+        finally:
+            semaphore.release()
+    
+    tasks = []
+    async with vector_db.async_rest_client() as client:
+        try:
+            batch_index = 0
+            while (batch := await inp.get()) is not None:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(insert_batch(client, batch_index, batch)))
+                batch_index += 1
+                if batch_index % 10 == 0:
+                    print(f"  Inserting batch {batch_index}...")
+            await asyncio.gather(*tasks)
+        finally:
+            # Cancelled: no requests may outlive the client (no-op when done)
+            for task in tasks:
+                task.cancel()
+    
+    return inserted
+
+
+async def run_pipeline(
+    data_dir: str = "data",
+    batch_size: int = 256,
+    chunk_threshold: int = 250,
+    concurrency: int = 4
+) -> int:
+    """
+    Flatten -> embed -> insert, with the three stages overlapping
+    
+    Stages are connected by bounded asyncio queues, so CPU flattening,
+    model encoding and HTTP inserts run at the same time and no
+    intermediate JSON is written. Nodes already in the database, and
+    duplicates within the data, are skipped before embedding. If a stage
+    fails, the others are stopped and the error is raised.
+    
+    Args:
+        data_dir: Directory containing JSON-LD files
+        batch_size: HyperNodes per embed / insert batch
+        chunk_threshold: Token threshold for chunking
+        concurrency: Insert requests in flight
+    
+    Returns:
+        Number of HyperNodes inserted
+    """
+    settings = get_settings()
+    embed_service = get_embedding_service()
+    vector_db = SupabaseVectorDB(
+        url=settings.supabase_url,
+        key=settings.supabase_anon_key
+    )
+    
+    # Re-runs only embed and insert what is not stored yet
+    seen_hashes = await asyncio.to_thread(vector_db.get_content_hashes)
+    print(f"{len(seen_hashes)} HyperNodes already indexed")
+    
+    jsonld_files = sorted(Path(data_dir).glob("ontology_node_*.jsonld"))
+    print(f"\nStreaming {len(jsonld_files)} plant files (batch size: {batch_size})...")
+    
+    loop = asyncio.get_running_loop()
+    flattened: "asyncio.Queue[Optional[List[Dict]]]" = asyncio.Queue(maxsize=4)
+    embedded: "asyncio.Queue[Optional[List[Dict]]]" = asyncio.Queue(maxsize=4)
+    stop = threading.Event()
+    
+    flatten_task = asyncio.create_task(asyncio.to_thread(
+        _flatten_stage, loop, flattened, jsonld_files, batch_size, chunk_threshold,
+        seen_hashes, stop
+    ))
+    embed_task = asyncio.create_task(_embed_stage(embed_service, flattened, embedded))
+    insert_task = asyncio.create_task(_insert_stage(vector_db, embedded, concurrency))
+    stages = (flatten_task, embed_task, insert_task)
+    
+    try:
+        await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # A failed (or interrupted) stage must not leave the others blocked
+        # on full queues: stop the flatten thread, cancel the async stages.
+        # All no-ops after a normal finish.
+        stop.set()
+        embed_task.cancel()
+        insert_task.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+    
+    # Surface the first stage error
+    for task in stages:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return insert_task.result()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Flatten, embed and index plants in one pass")
+    parser.add_argument("--data-dir", default="data", help="Directory with JSON-LD files")
+    parser.add_argument("--batch-size", type=int, default=256, help="Batch size")
+    parser.add_argument("--concurrency", type=int, default=4, help="Insert requests in flight")
+    
+    args = parser.parse_args()
+    
+    inserted = asyncio.run(run_pipeline(args.data_dir, args.batch_size, concurrency=args.concurrency))
+    print(f"\n✅ Inserted {inserted} HyperNodes")
@@ -3,9 +3,37 @@ CV API Client for Plant Classification
 Integrates with thuonguyenvan-plantsclassify.hf.space
 """
 import httpx
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import atexit
+import hashlib
+import logging
+import random
+import threading
 import time
 
+log = logging.getLogger("cv_api")
+
+
+def _read_image(image_path: str) -> Tuple[bytes, str]:
+    """Read an image file and return (bytes, cache key from its content hash)"""
+    image_bytes = Path(image_path).read_bytes()
+    return image_bytes, "file:" + hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Only timeouts, connection errors and 5xx responses are worth retrying"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, 2 ** attempt * 0.5)
+
 
 class CVAPIClient:
     """Client for plant classification API"""
@@ -14,7 +42,8 @@ class CVAPIClient:
         self,
         base_url: str = "https://thuonguyenvan-plantsclassify.hf.space",
         timeout: int = 60,
-        max_retries: int = 3
+        max_retries: int = 3,
+        cache_size: int = 1024
     ):
         """
         Initialize CV API client
@@ -23,11 +52,43 @@ class CVAPIClient:
             base_url: API base URL
             timeout: Request timeout in seconds
             max_retries: Maximum retry attempts on failure
+            cache_size: Number of classification results kept (LRU)
         """
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
         self.max_retries = max_retries
-        self.client = httpx.Client(timeout=timeout)
+        # Connection failures are retried by the transport itself
+        self.client = httpx.Client(
+            transport=httpx.HTTPTransport(retries=2, http2=True),
+            timeout=timeout
+        )
+        # Shared async client for the API server: HTTP/2 + pooled keep-alive
+        self.async_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=2,
+                http2=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+            ),
+            timeout=timeout
+        )
+        # Predictions keyed by image content hash / URL
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[Dict[str, float]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def _cache_get(self, cache_key: str) -> Optional[List[Dict[str, float]]]:
+        with self._cache_lock:
+            predictions = self._cache.get(cache_key)
+            if predictions is not None:
+                self._cache.move_to_end(cache_key)
+            return predictions
+    
+    def _cache_put(self, cache_key: str, predictions: List[Dict[str, float]]):
+        with self._cache_lock:
+            self._cache[cache_key] = predictions
+            self._cache.move_to_end(cache_key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
     
     def classify_image(
         self,
@@ -56,31 +117,107 @@ class CVAPIClient:
         if image_path and image_url:
             raise ValueError("Provide either image_path or image_url, not both")
         
+        # Identical images / URLs are answered from the cache
+        if image_path:
+            image_bytes, cache_key = _read_image(image_path)
+        else:
+            image_bytes, cache_key = None, "url:" + image_url
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Try with retries
         for attempt in range(self.max_retries):
             try:
-                if image_path:
-                    return self._classify_from_file(image_path)
+                if image_bytes is not None:
+                    predictions = self._classify_from_file(image_path, image_bytes)
                 else:
-                    return self._classify_from_url(image_url)
+                    predictions = self._classify_from_url(image_url)
+                self._cache_put(cache_key, predictions)
+                return predictions
             except Exception as e:
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt  # Exponential backoff
-                    print(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait_time}s...")
+                # 4xx and programming errors fail immediately
+                if _is_retryable(e) and attempt < self.max_retries - 1:
+                    wait_time = _backoff(attempt)
+                    log.warning("Attempt %d failed: %s. Retrying in %.1fs...", attempt + 1, e, wait_time)
                     time.sleep(wait_time)
                 else:
                     raise
     
-    def _classify_from_file(self, image_path: str) -> List[Dict[str, float]]:
+    async def classify_image_async(
+        self,
+        image_path: Optional[str] = None,
+        image_url: Optional[str] = None
+    ) -> List[Dict[str, float]]:
+        """
+        Async version of classify_image for use inside the event loop
+        
+        Args:
+            image_path: Path to local image file (for upload)
+            image_url: URL to image (for URL prediction)
+            
+        Returns:
+            List of predictions with class_name and confidence
+        """
+        if not image_path and not image_url:
+            raise ValueError("Either image_path or image_url must be provided")
+        
+        if image_path and image_url:
+            raise ValueError("Provide either image_path or image_url, not both")
+        
+        # Identical images / URLs are answered from the cache
+        if image_path:
+            image_bytes, cache_key = await asyncio.to_thread(_read_image, image_path)
+        else:
+            image_bytes, cache_key = None, "url:" + image_url
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Try with retries
+        for attempt in range(self.max_retries):
+            try:
+                if image_bytes is not None:
+                    predictions = await self._classify_from_file_async(image_path, image_bytes)
+                else:
+                    predictions = await self._classify_from_url_async(image_url)
+                self._cache_put(cache_key, predictions)
+                return predictions
+            except Exception as e:
+                # 4xx and programming errors fail immediately
+                if _is_retryable(e) and attempt < self.max_retries - 1:
+                    wait_time = _backoff(attempt)
+                    log.warning("Attempt %d failed: %s. Retrying in %.1fs...", attempt + 1, e, wait_time)
+                    await asyncio.sleep(wait_time)
+                else:
+                    raise
+    
+    async def _classify_from_file_async(self, image_path: str, image_bytes: bytes) -> List[Dict[str, float]]:
+        """Classify from uploaded file (async)"""
+        response = await self.async_client.post(
+            f"{self.base_url}/predict/upload",
+            files={'file': (Path(image_path).name, image_bytes)}
+        )
+        response.raise_for_status()
+        return response.json()['predictions']
+    
+    async def _classify_from_url_async(self, image_url: str) -> List[Dict[str, float]]:
+        """Classify from image URL (async)"""
+        response = await self.async_client.post(
+            f"{self.base_url}/predict/url",
+            json={"url": image_url}
+        )
+        response.raise_for_status()
+        return response.json()['predictions']
+    
+    def _classify_from_file(self, image_path: str, image_bytes: bytes) -> List[Dict[str, float]]:
         """Classify from uploaded file"""
-        with open(image_path, 'rb') as f:
-            files = {'file': f}
-            response = self.client.post(
-                f"{self.base_url}/predict/upload",
-                files=files
-            )
-            response.raise_for_status()
-            return response.json()['predictions']
+        response = self.client.post(
+            f"{self.base_url}/predict/upload",
+            files={'file': (Path(image_path).name, image_bytes)}
+        )
+        response.raise_for_status()
+        return response.json()['predictions']
     
     def _classify_from_url(self, image_url: str) -> List[Dict[str, float]]:
         """Classify from image URL"""
@@ -99,9 +236,26 @@ class CVAPIClient:
         except:
             return False
     
-    def __del__(self):
-        """Cleanup client"""
+    def close(self):
+        """Close the sync HTTP client and release its connections"""
+        self.client.close()
+    
+    async def aclose(self):
+        """Close both HTTP clients (call from the event loop)"""
         self.client.close()
+        await self.async_client.aclose()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
 
 
 # Singleton instance
@@ -117,4 +271,5 @@ def get_cv_api_client() -> CVAPIClient:
             base_url=settings.cv_api_url,
             timeout=settings.cv_api_timeout
         )
+        atexit.register(_cv_api_client.close)
     return _cv_api_client
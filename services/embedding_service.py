@@ -2,24 +2,35 @@
 Vietnamese Embedding Service using AITeamVN/Vietnamese_Embedding
 """
 from sentence_transformers import SentenceTransformer
+import torch
 from typing import List, Union
 import numpy as np
 from functools import lru_cache
+from services.llm_cache import LRUCache
 
 
 class VietnameseEmbeddingService:
-    """Service for generating Vietnamese text embeddings"""
+    """
+    Service for generating Vietnamese text embeddings
     
-    def __init__(self, model_name: str = "AITeamVN/Vietnamese_Embedding"):
+    All embeddings are L2-normalized, so cosine similarity is a dot product.
+    """
+    
+    def __init__(self, model_name: str = "AITeamVN/Vietnamese_Embedding", cache_size: int = 10000):
         """
         Initialize embedding service
         
         Args:
             model_name: HuggingFace model name
+            cache_size: Number of single-text embeddings kept (LRU)
         """
         print(f"Loading embedding model: {model_name}...")
         self.model = SentenceTransformer(model_name)
+        if torch.cuda.is_available():
+            self.model.half()  # FP16 on GPU: half the memory traffic, tensor cores
         self.dimension = 1024  # Vietnamese_Embedding actual dimension is 1024
+        # Query embeddings shared by RAG retrieval and the LLM semantic cache
+        self._query_cache = LRUCache(maxsize=cache_size)
         print(f"Model loaded successfully. Dimension: {self.dimension}")
     
     def embed_text(self, text: str) -> List[float]:
@@ -32,8 +43,76 @@ class VietnameseEmbeddingService:
         Returns:
             Embedding vector as list of floats
         """
-        embedding = self.model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        return self.embed_query(text).tolist()
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embedding for a single text, cached across calls
+        
+        The same question is embedded by several layers (semantic cache,
+        RAG retrieval, result cache); only the first pays for a forward pass.
+        
+        Args:
+            text: Input text in Vietnamese
+            
+        Returns:
+            Read-only normalized float32 vector, shape (dimension,)
+        """
+        vector = self._query_cache.get(text)
+        if vector is None:
+            # float32 even when the model runs in FP16 (GPU)
+            vector = self.embed_many([text], show_progress_bar=False)[0].astype(np.float32, copy=False)
+            vector.setflags(write=False)  # Shared between callers
+            self._query_cache.put(text, vector)
+        return vector
+    
+    def embed_queries(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        embed_query() for several texts, encoding all cache misses in one batch
+        
+        Args:
+            texts: Input texts in Vietnamese
+            
+        Returns:
+            Read-only normalized float32 vectors, in input order
+        """
+        vectors = [self._query_cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            encoded = {}
+            for text, vector in zip(missing, self.embed_many(missing, show_progress_bar=False)):
+                vector = vector.astype(np.float32, copy=False)
+                vector.setflags(write=False)  # Shared between callers
+                self._query_cache.put(text, vector)
+                encoded[text] = vector
+            vectors = [encoded[text] if vector is None else vector
+                       for text, vector in zip(texts, vectors)]
+        return vectors
+    
+    def embed_many(
+        self,
+        texts: List[str],
+        batch_size: int = 256,
+        show_progress_bar: bool = True
+    ) -> np.ndarray:
+        """
+        Generate embeddings for many texts in one batched encode
+        
+        Args:
+            texts: List of input texts
+            batch_size: Batch size for encoding
+            show_progress_bar: Show encode progress
+            
+        Returns:
+            Array of shape (len(texts), dimension)
+        """
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=show_progress_bar
+        )
     
     def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
         """
@@ -50,6 +129,7 @@ class VietnameseEmbeddingService:
             texts,
             batch_size=batch_size,
             convert_to_numpy=True,
+            normalize_embeddings=True,
             show_progress_bar=len(texts) > 100
         )
         return embeddings.tolist()
@@ -58,6 +138,9 @@ class VietnameseEmbeddingService:
         """
         Calculate cosine similarity between two embeddings
         
+        Both inputs must be normalized (as returned by this service), so
+        the cosine reduces to a dot product.
+        
         Args:
             embedding1: First embedding vector
             embedding2: Second embedding vector
@@ -65,14 +148,7 @@ class VietnameseEmbeddingService:
         Returns:
             Similarity score (0 to 1)
         """
-        vec1 = np.array(embedding1)
-        vec2 = np.array(embedding2)
-        
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        return float(dot_product / (norm1 * norm2))
+        return float(np.dot(embedding1, embedding2))
 
 
 @lru_cache()
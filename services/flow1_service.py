@@ -4,7 +4,7 @@ Returns top-5 predictions with plant summaries
 """
 from typing import List, Dict, Optional
 from services.cv_api_client import CVAPIClient
-from utils.data_loader import PlantDataLoader
+from utils.data_loader import PlantDataLoader, build_plant_summary
 
 
 class Flow1Service:
@@ -46,7 +46,26 @@ class Flow1Service:
             image_path=image_path,
             image_url=image_url
         )
+        return self._enrich_predictions(predictions)
+    
+    async def classify_and_summarize_async(
+        self,
+        image_path: Optional[str] = None,
+        image_url: Optional[str] = None
+    ) -> Dict:
+        """
+        Async version of classify_and_summarize
         
+        The CV call is awaited, so other requests are served while it runs.
+        """
+        predictions = await self.cv_client.classify_image_async(
+            image_path=image_path,
+            image_url=image_url
+        )
+        return self._enrich_predictions(predictions)
+    
+    def _enrich_predictions(self, predictions: List[Dict]) -> Dict:
+        """Attach plant data and summaries to the top-5 CV predictions"""
         # Enrich with plant data
         enriched_predictions = []
         
@@ -111,47 +130,10 @@ class Flow1Service:
         }
     
     def _generate_summary(self, plant_data: Dict) -> Dict:
-        """Generate concise summary from plant data"""
-        summary = {}
-        
-        # Extract key information
-        if "Mô tả" in plant_data and plant_data["Mô tả"]:
-            mo_ta = plant_data["Mô tả"]
-            if isinstance(mo_ta, dict):
-                # Combine all description parts
-                desc_parts = []
-                for key, value in mo_ta.items():
-                    if value and str(value).strip():
-                        desc_parts.append(f"{key.capitalize()}: {value}")
-                if desc_parts:
-                    summary["description"] = " ".join(desc_parts)[:300] + ("..." if len(" ".join(desc_parts)) > 300 else "")
-        
-        if "Công dụng" in plant_data and plant_data["Công dụng"]:
-            cong_dung = plant_data["Công dụng"]
-            if isinstance(cong_dung, dict):
-                # Get first use item
-                for key, value in cong_dung.items():
-                    if value:
-                        summary["uses"] = str(value)[:200] + "..."
-                        break
-        
-        if "Cách dùng" in plant_data and plant_data["Cách dùng"]:
-            cach_dung = plant_data["Cách dùng"]
-            if isinstance(cach_dung, dict):
-                for key, value in cach_dung.items():
-                    if value:
-                        summary["usage"] = str(value)[:150] + "..."
-                        break
-        
-        if "luu_y" in plant_data and plant_data["luu_y"]:
-            luu_y = plant_data["luu_y"]
-            if isinstance(luu_y, dict):
-                for key, value in luu_y.items():
-                    if value:
-                        summary["warnings"] = str(value)[:150] + "..."
-                        break
-        
-        return summary
+        """Concise summary, precomputed by PlantDataLoader when the data was loaded"""
+        if "_summary" in plant_data:
+            return plant_data["_summary"]
+        return build_plant_summary(plant_data)
 
 
 def get_flow1_service(
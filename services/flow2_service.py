@@ -2,12 +2,24 @@
 Flow 2 Service: Image + Text Q&A
 LLM-based routing with full plant context
 """
-from typing import Dict, Optional
+import asyncio
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
 from services.cv_api_client import CVAPIClient
+from services.llm_cache import LRUCache, hash_key
 from services.llm_client import MegLLMClient
 from services.ograg_engine import OGRAGQueryEngine
-from utils.data_loader import PlantDataLoader
-import json
+from utils.data_loader import PlantDataLoader, build_plant_context
+import orjson
+import re
+
+
+# Routing replies are just {"needs_rag": true|false} (~10 tokens); the cap
+# leaves headroom without letting a chatty model ramble
+ROUTING_MAX_TOKENS = 32
+
+# First {...} block in a routing response
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
 
 
 class Flow2Service:
@@ -24,6 +36,8 @@ class Flow2Service:
         self.llm_client = llm_client
         self.og_rag = og_rag
         self.data_loader = data_loader
+        # Parsed routing decisions keyed by (question, plant)
+        self._routing_cache = LRUCache(maxsize=4096)
     
     def identify_plant(
         self,
@@ -58,28 +72,32 @@ class Flow2Service:
             image_url=image_url
         )
         
-        # Enrich predictions with Vietnamese names
-        enriched_predictions = []
-        for pred in predictions[:top_k]:
-            plant_data = self.data_loader.get_plant_by_class(pred['class_name'])
-            if plant_data:
-                enriched_predictions.append({
-                    "class_name": pred['class_name'],
-                    "vietnamese_name": plant_data.get('ten', ''),
-                    "scientific_name": plant_data.get('ten_khoa_hoc', ''),
-                    "confidence": pred['confidence']
-                })
-            else:
-                # Fallback if data not found
-                enriched_predictions.append({
-                    "class_name": pred['class_name'],
-                    "vietnamese_name": pred['class_name'],
-                    "scientific_name": "",
-                    "confidence": pred['confidence']
-                })
+        # Enrich predictions with Vietnamese names (in-memory dict lookups)
+        get_plant = self.data_loader.get_plant_by_class
+        enriched_predictions = [
+            self._enrich_prediction(pred, get_plant(pred['class_name']))
+            for pred in predictions[:top_k]
+        ]
         
         return {"predictions": enriched_predictions}
     
+    @staticmethod
+    def _enrich_prediction(pred: Dict, plant_data: Optional[Dict]) -> Dict:
+        """Prediction with names from plant data (class name as fallback)"""
+        if not plant_data:
+            return {
+                "class_name": pred['class_name'],
+                "vietnamese_name": pred['class_name'],
+                "scientific_name": "",
+                "confidence": pred['confidence']
+            }
+        return {
+            "class_name": pred['class_name'],
+            "vietnamese_name": plant_data.get('ten', ''),
+            "scientific_name": plant_data.get('ten_khoa_hoc', ''),
+            "confidence": pred['confidence']
+        }
+    
     def answer_with_plant(
         self,
         question: str,
@@ -108,11 +126,7 @@ class Flow2Service:
         if not plant_data:
             return {"error": "Plant data not found"}
         
-        plant_info = {
-            "class_name": plant_class_name,
-            "vietnamese_name": plant_data.get("ten", ""),
-            "scientific_name": plant_data.get("ten_khoa_hoc", "")
-        }
+        plant_info = self._plant_info(plant_class_name, plant_data)
         
         # Build full context
         full_context = self._build_full_context(plant_data)
@@ -123,22 +137,9 @@ class Flow2Service:
         
         if needs_rag:
             # Query RAG for additional plants
-            rag_results = self.og_rag.query(question, top_k=5)
-            
-            # Filter out current plant
-            rag_results = [r for r in rag_results 
-                          if r['plant_name'] != plant_info['vietnamese_name']][:3]
-            
-            # Build combined context
-            combined_context = f"""## Cây từ ảnh: {plant_info['vietnamese_name']}
-
-{full_context}
-
-## Thông tin các cây khác liên quan:
-
-"""
-            for result in rag_results:
-                combined_context += f"\n- **{result['plant_name']}** - {result['key']}: {result['value']}\n"
+            rag_results, combined_context = self._combine_with_rag(
+                plant_info, full_context, self.og_rag.query(question, top_k=5)
+            )
             
             answer = self.llm_client.answer_question(
                 question=question,
@@ -164,6 +165,81 @@ class Flow2Service:
                 "answer": answer
             }
     
+    async def answer_with_plant_async(
+        self,
+        question: str,
+        plant_class_name: str,
+        use_rag: bool = True
+    ) -> Dict:
+        """
+        Async version of answer_with_plant() for use inside the event loop
+        
+        The RAG query is started speculatively alongside routing, so a
+        RAG answer costs max(routing, retrieval) + answer instead of the
+        sum of all three. If routing decides RAG is not needed, the
+        retrieval result is discarded.
+        
+        Args:
+            question: User question
+            plant_class_name: Selected plant class name
+            use_rag: Whether to search additional plants via RAG
+            
+        Returns:
+            Same as answer_with_plant()
+        """
+        plant_data = self.data_loader.get_plant_by_class(plant_class_name)
+        
+        if not plant_data:
+            return {"error": "Plant data not found"}
+        
+        plant_info = self._plant_info(plant_class_name, plant_data)
+        full_context = self._build_full_context(plant_data)
+        
+        rag_task = None
+        if use_rag:
+            rag_task = asyncio.create_task(self.og_rag.aquery(question, top_k=5))
+            # Retrieve the error of a discarded speculative query so it isn't logged as unhandled
+            rag_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            routing_decision = await self._llm_routing_async(question, plant_info['vietnamese_name'])
+            needs_rag = routing_decision['needs_rag'] and use_rag
+        except BaseException:
+            if rag_task is not None:
+                rag_task.cancel()
+            raise
+        
+        if needs_rag:
+            rag_results, combined_context = self._combine_with_rag(
+                plant_info, full_context, await rag_task
+            )
+            
+            answer = await self.llm_client.aanswer_question(
+                question=question,
+                context=combined_context
+            )
+            
+            return {
+                "identified_plant": plant_info,
+                "needs_rag": True,
+                "answer": answer,
+                "rag_context": rag_results
+            }
+        
+        if rag_task is not None:
+            # The worker thread runs to completion; its result is dropped
+            rag_task.cancel()
+        
+        answer = await self.llm_client.aanswer_question(
+            question=question,
+            context=full_context
+        )
+        
+        return {
+            "identified_plant": plant_info,
+            "needs_rag": False,
+            "answer": answer
+        }
+    
     def answer_question(
         self,
         question: str,
@@ -199,37 +275,68 @@ class Flow2Service:
         
         return result
     
-    def _build_full_context(self, plant_data: Dict) -> str:
-        """Build complete plant context string"""
-        context_parts = []
+    async def answer_question_async(
+        self,
+        question: str,
+        image_path: Optional[str] = None,
+        image_url: Optional[str] = None
+    ) -> Dict:
+        """Async version of answer_question()"""
+        predictions = await self.cv_client.classify_image_async(
+            image_path=image_path,
+            image_url=image_url
+        )
         
-        # Basic info
-        context_parts.append(f"**Tên:** {plant_data.get('ten', '')}")
-        context_parts.append(f"**Tên khoa học:** {plant_data.get('ten_khoa_hoc', '')}")
-        context_parts.append(f"**Họ:** {plant_data.get('ho', '')}")
+        top_prediction = predictions[0]
+        result = await self.answer_with_plant_async(
+            question, top_prediction['class_name'], use_rag=True
+        )
         
-        # Sections
-        sections = [
-            ("Mô tả", "Mô tả"),
-            ("Phân bố", "Phân bố"),
-            ("Công dụng", "Công dụng"),
-            ("Cách dùng", "Cách dùng"),
-            ("Thành phần", "Thành phần"),
-            ("Tính vị", "Tính vị"),
-            ("Bộ phận dùng", "Bộ phận dùng"),
-            ("luu_y", "Lưu ý")
-        ]
+        if "identified_plant" in result:
+            result["identified_plant"]["confidence"] = top_prediction['confidence']
+        
+        return result
+    
+    @staticmethod
+    def _plant_info(plant_class_name: str, plant_data: Dict) -> Dict:
+        """Identity fields returned as identified_plant"""
+        return {
+            "class_name": plant_class_name,
+            "vietnamese_name": plant_data.get("ten", ""),
+            "scientific_name": plant_data.get("ten_khoa_hoc", "")
+        }
+    
+    @staticmethod
+    def _combine_with_rag(
+        plant_info: Dict,
+        full_context: str,
+        rag_results: List[Dict]
+    ) -> Tuple[List[Dict], str]:
+        """Drop the identified plant from RAG results and append the rest to its context"""
+        # Filter out current plant, stopping at the first 3 others
+        current = plant_info['vietnamese_name']
+        rag_results = list(islice((r for r in rag_results if r['plant_name'] != current), 3))
         
-        for key, title in sections:
-            if key in plant_data and plant_data[key]:
-                section_data = plant_data[key]
-                if isinstance(section_data, dict):
-                    context_parts.append(f"\n### {title}")
-                    for sub_key, sub_value in section_data.items():
-                        if sub_value:
-                            context_parts.append(f"- **{sub_key}**: {sub_value}")
+        # Build combined context (one join instead of repeated +=)
+        parts = [f"""## Cây từ ảnh: {plant_info['vietnamese_name']}
+
+{full_context}
+
+## Thông tin các cây khác liên quan:
+
+"""]
+        parts.extend(
+            f"\n- **{result['plant_name']}** - {result['key']}: {result['value']}\n"
+            for result in rag_results
+        )
         
-        return "\n".join(context_parts)
+        return rag_results, "".join(parts)
+    
+    def _build_full_context(self, plant_data: Dict) -> str:
+        """Complete plant context string, precomputed by PlantDataLoader when the data was loaded"""
+        if "_context" in plant_data:
+            return plant_data["_context"]
+        return build_plant_context(plant_data)
     
     def _llm_routing(self, question: str, plant_name: str) -> Dict:
         """
@@ -238,7 +345,46 @@ class Flow2Service:
         Returns:
             {"needs_rag": bool, "reasoning": str}
         """
-        routing_prompt = f"""Bạn là hệ thống phân tích câu hỏi về dược liệu.
+        cache_key = hash_key(question, plant_name)
+        cached = self._routing_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        try:
+            response = self.llm_client.chat(
+                messages=[{"role": "user", "content": self._routing_prompt(question, plant_name)}],
+                temperature=0.0,
+                max_tokens=ROUTING_MAX_TOKENS,
+                response_format={"type": "json_object"}
+            )
+            return self._parse_routing(response, cache_key)
+        except:
+            # On error, fallback to no RAG
+            return {"needs_rag": False}
+    
+    async def _llm_routing_async(self, question: str, plant_name: str) -> Dict:
+        """Async version of _llm_routing()"""
+        cache_key = hash_key(question, plant_name)
+        cached = self._routing_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        try:
+            response = await self.llm_client.achat(
+                messages=[{"role": "user", "content": self._routing_prompt(question, plant_name)}],
+                temperature=0.0,
+                max_tokens=ROUTING_MAX_TOKENS,
+                response_format={"type": "json_object"}
+            )
+            return self._parse_routing(response, cache_key)
+        except Exception:
+            # On error, fallback to no RAG
+            return {"needs_rag": False}
+    
+    @staticmethod
+    def _routing_prompt(question: str, plant_name: str) -> str:
+        """Prompt asking whether other plants are needed to answer"""
+        return f"""Bạn là hệ thống phân tích câu hỏi về dược liệu.
 
 Câu hỏi: "{question}"
 Cây được nhận diện: "{plant_name}"
@@ -248,25 +394,25 @@ Hãy quyết định xem câu hỏi này:
 - CHỈ cần thông tin về cây "{plant_name}" → trả về {{"needs_rag": false}}
 
 CHỈ trả về JSON, không giải thích."""
-
+    
+    def _parse_routing(self, response: str, cache_key: str) -> Dict:
+        """Parse the routing JSON, caching it only when it is a valid decision"""
         try:
-            response = self.llm_client.chat(
-                messages=[{"role": "user", "content": routing_prompt}],
-                temperature=0.1,
-                max_tokens=100
-            )
-            
-            # Parse JSON response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            else:
+            # JSON mode: the whole response is the object
+            decision = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            # Models behind the gateway that ignore JSON mode may wrap it in text
+            json_match = _JSON_RE.search(response)
+            if not json_match:
                 # Fallback: assume no RAG needed
                 return {"needs_rag": False}
-        except:
-            # On error, fallback to no RAG
+            decision = orjson.loads(json_match.group())
+        if not (isinstance(decision, dict) and isinstance(decision.get("needs_rag"), bool)):
+            # Parsed, but not a routing decision: fall back, uncached
             return {"needs_rag": False}
+        # Only valid decisions are cached, never the fallback
+        self._routing_cache.put(cache_key, decision)
+        return dict(decision)
 
 
 def get_flow2_service(
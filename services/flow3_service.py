@@ -1,11 +1,19 @@
 """
 Flow 3 Service: Pure RAG (Text-Only Q&A) with Query Reformulation
 """
+import logging
 from typing import Dict, List
 from services.llm_client import MegLLMClient
 from services.ograg_engine import OGRAGQueryEngine
 from services.query_reformulator import SmartQueryReformulator
 
+log = logging.getLogger("flow3")
+
+# System prompts (module constants: identical bytes on every call)
+CHITCHAT_SYSTEM_PROMPT = """Bạn là trợ lý AI thân thiện về dược liệu Việt Nam.
+Trả lời câu hỏi một cách tự nhiên, lịch sự."""
+COMPARISON_SYSTEM_PROMPT = "Bạn là chuyên gia dược liệu."
+
 
 class Flow3Service:
     """Service for Flow 3: Text-only RAG with Query Reformulation"""
@@ -26,7 +34,8 @@ class Flow3Service:
         question: str,
         top_k: int = 10,
         conversation_history: List[Dict] = None,
-        selected_plant: str = None  # NEW: Track selected plant from frontend
+        selected_plant: str = None,  # NEW: Track selected plant from frontend
+        stream: bool = False
     ) -> Dict:
         """
         Answer question using RAG with conversation context and query reformulation
@@ -36,6 +45,8 @@ class Flow3Service:
             top_k: Number of RAG results
             conversation_history: Previous conversation messages
             selected_plant: Plant user selected from modal (if any)
+            stream: Return the answer as an iterator of text chunks
+                (generated lazily) instead of a string
             
         Returns:
             {
@@ -53,22 +64,23 @@ class Flow3Service:
             selected_plant=selected_plant
         )
         
-        # DEBUG: Print reformulation
-        print(f"\n🔍 REFORMULATION DEBUG:")
-        print(f"  Original: {question}")
-        print(f"  Reformulated: {reformulation.get('reformulated_query')}")
-        print(f"  Intent: {reformulation.get('intent')}")
-        print(f"  Target plants: {reformulation.get('target_plants')}")
-        print(f"  Reasoning: {reformulation.get('reasoning')}\n")
+        log.debug(
+            "Reformulation: original=%r reformulated=%r intent=%s targets=%s reasoning=%s",
+            question,
+            reformulation.get('reformulated_query'),
+            reformulation.get('intent'),
+            reformulation.get('target_plants'),
+            reformulation.get('reasoning')
+        )
         
         # Step 2: Handle based on intent
         if reformulation["intent"] == "chitchat" or not reformulation["needs_rag"]:
             # Direct reply without RAG
-            return self._handle_chitchat(question, conversation_history, reformulation)
+            return self._handle_chitchat(question, conversation_history, reformulation, stream)
         
         if reformulation["intent"] == "comparison":
             # Handle comparison queries (multiple RAG calls)
-            return self._handle_comparison(reformulation, conversation_history, top_k)
+            return self._handle_comparison(reformulation, conversation_history, top_k, stream)
         
         # Step 3: Use reformulated query for RAG
         reformulated_query = reformulation["reformulated_query"]
@@ -80,10 +92,7 @@ class Flow3Service:
             # (comparison handled separately above)
             plant_filter = reformulation["target_plants"][0]
         
-        print(f"🔎 RAG QUERY:")
-        print(f"  Query text: {reformulated_query}")
-        print(f"  Plant filter: {plant_filter}")
-        print(f"  Top-K: {top_k}\n")
+        log.debug("RAG query: %r plant_filter=%s top_k=%s", reformulated_query, plant_filter, top_k)
         
         # Query RAG
         rag_results = self.og_rag.query(
@@ -92,19 +101,19 @@ class Flow3Service:
             plant_filter=plant_filter
         )
         
-        # DEBUG: Print RAG results
-        print(f"📊 RAG RESULTS: {len(rag_results)} documents")
-        for i, result in enumerate(rag_results[:5]):  # Show top 5
-            print(f"  {i+1}. {result.get('plant_name')} (similarity: {result.get('similarity', 0):.3f})")
-            print(f"     {result.get('key')}: {result.get('value')[:100]}...")
-        print()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("RAG results: %d documents", len(rag_results))
+            for i, result in enumerate(rag_results[:5]):  # Show top 5
+                log.debug(
+                    "  %d. %s (similarity: %.3f) %s: %.100s",
+                    i + 1, result.get('plant_name'), result.get('similarity', 0),
+                    result.get('key'), result.get('value')
+                )
         
         # Filter out excluded plants if any
         if reformulation.get("excluded_plants"):
-            rag_results = [
-                r for r in rag_results
-                if r['plant_name'] not in reformulation["excluded_plants"]
-            ]
+            excluded = frozenset(reformulation["excluded_plants"])
+            rag_results = [r for r in rag_results if r['plant_name'] not in excluded]
         
         if not rag_results:
             context = "Không tìm thấy thông tin dược liệu trực tiếp liên quan."
@@ -112,7 +121,9 @@ class Flow3Service:
             context = self.og_rag.build_rag_context(rag_results, max_context_length=2000)
         
         # Generate answer with history
-        answer = self.llm_client.answer_with_history(
+        answer_with_history = (self.llm_client.answer_with_history_stream if stream
+                               else self.llm_client.answer_with_history)
+        answer = answer_with_history(
             question=question,  # Keep original question for natural flow
             context=context,
             conversation_history=conversation_history
@@ -138,18 +149,17 @@ class Flow3Service:
         self,
         question: str,
         conversation_history: List[Dict],
-        reformulation: Dict
+        reformulation: Dict,
+        stream: bool = False
     ) -> Dict:
         """Handle chitchat without RAG"""
-        system_prompt = """Bạn là trợ lý AI thân thiện về dược liệu Việt Nam.
-Trả lời câu hỏi một cách tự nhiên, lịch sự."""
-        
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": CHITCHAT_SYSTEM_PROMPT}]
         if conversation_history:
             messages.extend(conversation_history[-4:])  # Last 4 turns
         messages.append({"role": "user", "content": question})
         
-        answer = self.llm_client.chat(messages, temperature=0.8)
+        chat = self.llm_client.chat_stream if stream else self.llm_client.chat
+        answer = chat(messages, temperature=0.8)
         
         return {
             "question": question,
@@ -167,7 +177,8 @@ Trả lời câu hỏi một cách tự nhiên, lịch sự."""
         self,
         reformulation: Dict,
         conversation_history: List[Dict],
-        top_k: int
+        top_k: int,
+        stream: bool = False
     ) -> Dict:
         """Handle comparison queries by querying multiple plants"""
         target_plants = reformulation["target_plants"]
@@ -177,15 +188,15 @@ Trả lời câu hỏi một cách tự nhiên, lịch sự."""
         if isinstance(queries, str):
             queries = [f"{queries} {plant}" for plant in target_plants]
         
-        # Query each plant separately
+        # Query each plant separately (concurrently, one batched embedding)
+        pairs = list(zip(target_plants, queries))
         all_results = []
-        for plant, query in zip(target_plants, queries):
-            results = self.og_rag.query(
-                query_text=query,
+        if pairs:
+            all_results = self.og_rag.query_batch(
+                [query for _, query in pairs],
                 top_k=top_k // len(target_plants),  # Split top_k
-                plant_filter=plant
+                plant_filters=[plant for plant, _ in pairs]
             )
-            all_results.extend(results)
         
         # Build context
         if not all_results:
@@ -201,12 +212,13 @@ Thông tin:
 
 Hãy so sánh các điểm giống và khác nhau một cách rõ ràng."""
         
-        messages = [{"role": "system", "content": "Bạn là chuyên gia dược liệu."}]
+        messages = [{"role": "system", "content": COMPARISON_SYSTEM_PROMPT}]
         if conversation_history:
             messages.extend(conversation_history[-2:])
         messages.append({"role": "user", "content": comparison_prompt})
         
-        answer = self.llm_client.chat(messages, temperature=0.3)
+        chat = self.llm_client.chat_stream if stream else self.llm_client.chat
+        answer = chat(messages, temperature=0.3)
         
         sources = self._extract_sources(all_results) if all_results else []
         
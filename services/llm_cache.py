@@ -0,0 +1,189 @@
+"""
+LLM Response Caches
+Exact (hash-keyed) and semantic (embedding-keyed) caches for chat completions
+"""
+import bisect
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+import orjson
+
+
+def hash_key(*parts: Any) -> str:
+    """SHA-256 over the JSON encoding of all parts (stable cache key)"""
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe bounded dict, least recently used entries evicted first"""
+    
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+    
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class _ScopeEntries:
+    """Query vectors and values of one scope, oldest first"""
+    
+    __slots__ = ("vectors", "values", "stored_at", "_matrix")
+    
+    def __init__(self):
+        self.vectors: List[np.ndarray] = []
+        self.values: List[Any] = []
+        self.stored_at: List[float] = []
+        self._matrix: Optional[np.ndarray] = None
+    
+    def matrix(self) -> np.ndarray:
+        """Stacked vectors, rebuilt only after the entries changed"""
+        if self._matrix is None:
+            self._matrix = np.stack(self.vectors)
+        return self._matrix
+    
+    def append(self, vector: np.ndarray, value: Any, limit: int):
+        self.vectors.append(vector)
+        self.values.append(value)
+        self.stored_at.append(time.monotonic())
+        if len(self.vectors) > limit:
+            self.drop_oldest(len(self.vectors) - limit)
+        self._matrix = None
+    
+    def drop_oldest(self, count: int):
+        del self.vectors[:count], self.values[:count], self.stored_at[:count]
+        self._matrix = None
+    
+    def drop_expired(self, ttl: float):
+        # Store times are ascending - the expired entries are a prefix
+        count = bisect.bisect_left(self.stored_at, time.monotonic() - ttl)
+        if count:
+            self.drop_oldest(count)
+
+
+class SemanticCache:
+    """
+    Cache values by meaning of a query instead of its exact text
+    
+    Entries are grouped by an exact scope key (model, sampling params,
+    system prompt, context, ...), and only the query is compared by
+    embedding. A paraphrased question about the same context is a hit;
+    the same question against a different context never is.
+    """
+    
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+        distance_threshold: float = 0.1,
+        max_scopes: int = 1024,
+        max_entries_per_scope: int = 32,
+        ttl: Optional[float] = None
+    ):
+        """
+        Initialize semantic cache
+        
+        Args:
+            embed: Function returning a normalized embedding for a text
+                (only needed by check() / store())
+            distance_threshold: Max cosine distance (1 - similarity) for a hit
+            max_scopes: Number of scopes kept (LRU)
+            max_entries_per_scope: Queries kept per scope (oldest dropped)
+            ttl: Seconds an entry stays valid (None: until evicted)
+        """
+        self.embed = embed
+        self.distance_threshold = distance_threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self.ttl = ttl
+        # scope -> _ScopeEntries
+        self._scopes = LRUCache(maxsize=max_scopes)
+        self._lock = threading.Lock()
+    
+    def check(self, scope: str, query: str) -> Optional[Any]:
+        """
+        Look up a cached value
+        
+        Args:
+            scope: Exact scope key from hash_key()
+            query: Query text to compare semantically
+        
+        Returns:
+            Cached value, or None on miss
+        """
+        # Unknown scope: miss without paying for an embedding
+        if self._scopes.get(scope) is None:
+            return None
+        return self.check_vector(scope, self.embed(query))
+    
+    def check_vector(self, scope: str, vector: np.ndarray) -> Optional[Any]:
+        """
+        Look up a cached value by an already computed query embedding
+        
+        Args:
+            scope: Exact scope key from hash_key()
+            vector: Normalized query embedding
+        
+        Returns:
+            Cached value, or None on miss
+        """
+        entry = self._scopes.get(scope)
+        if entry is None:
+            return None
+        
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self.ttl is not None:
+                entry.drop_expired(self.ttl)
+            if not entry.vectors:
+                return None
+            scores = entry.matrix() @ vector
+            best = int(np.argmax(scores))
+            if 1.0 - float(scores[best]) < self.distance_threshold:
+                return entry.values[best]
+        return None
+    
+    def store(self, scope: str, query: str, value: Any):
+        """
+        Store a value for a query
+        
+        Args:
+            scope: Exact scope key from hash_key()
+            query: Query text
+            value: Value to cache (e.g. LLM response)
+        """
+        self.store_vector(scope, self.embed(query), value)
+    
+    def store_vector(self, scope: str, vector: np.ndarray, value: Any):
+        """
+        Store a value under an already computed query embedding
+        
+        Args:
+            scope: Exact scope key from hash_key()
+            vector: Normalized query embedding
+            value: Value to cache
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                entry = _ScopeEntries()
+                self._scopes.put(scope, entry)
+            entry.append(vector, value, self.max_entries_per_scope)
@@ -2,9 +2,66 @@
 MegLLM API Client
 OpenAI-compatible API using openai SDK
 """
+import asyncio
+import atexit
+import httpx
+import orjson
 import re
-from typing import List, Dict, Optional
-from openai import OpenAI
+from typing import Iterable, Iterator, List, Dict, Optional
+from openai import AsyncOpenAI, OpenAI
+from services.llm_cache import LRUCache, SemanticCache, hash_key
+
+
+# Default system prompt for answer_question()
+ANSWER_SYSTEM_PROMPT = """Bạn là trợ lý AI chuyên về dược liệu Việt Nam.
+Nhiệm vụ của bạn là trả lời câu hỏi dựa trên thông tin được cung cấp.
+Trả lời chính xác, ngắn gọn, dễ hiểu bằng tiếng Việt."""
+
+
+# Default system prompt for answer_with_history()
+ANSWER_WITH_HISTORY_SYSTEM_PROMPT = """Bạn là trợ lý AI chuyên về dược liệu Việt Nam.
+
+NHIỆM VỤ:
+- Trả lời câu hỏi CHÍNH XÁC dựa HOÀN TOÀN trên thông tin được cung cấp
+- Nhớ và sử dụng thông tin từ cuộc trò chuyện trước đó
+
+QUY TẮC QUAN TRỌNG:
+1. CHỈ sử dụng thông tin có trong "Thông tin dược liệu liên quan" để trả lời
+2. KHÔNG đưa ra thông tin bạn không chắc chắn hoặc không có trong context
+3. NẾU thông tin không có trong context, hãy thẳng thắn nói: "Xin lỗi, tôi không tìm thấy thông tin về [tên cây/câu hỏi] trong cơ sở dữ liệu."
+4. KHÔNG bịa đặt, suy luận, hoặc đưa ra thông tin từ kiến thức chung
+5. NẾU context trống hoặc không liên quan đến câu hỏi, hãy nói: "Tôi không có thông tin về câu hỏi này."
+
+PHONG CÁCH:
+- Thân thiện, lịch sự
+- Chính xác, có căn cứ từ context
+- Ngắn gọn, dễ hiểu bằng tiếng Việt
+- Thẳng thắn thừa nhận khi không biết"""
+
+
+# System prompt for route_query()
+ROUTE_SYSTEM_PROMPT = """Bạn là chuyên gia phân loại câu hỏi về dược liệu Việt Nam.
+
+NHIỆM VỤ: Xác định câu hỏi cần tra cứu database (RAG) hay có thể trả lời trực tiếp.
+
+CẦN RAG khi:
+- Hỏi về cây cụ thể (tên, công dụng, cách dùng)
+- Tìm cây chữa bệnh cụ thể
+- So sánh nhiều loại cây
+- Câu hỏi chi tiết về dược liệu
+
+TRẢ LỜI TRỰC TIẾP khi:
+- Chào hỏi, giới thiệu
+- Hỏi về khả năng/chức năng của AI
+- Câu hỏi general (không cần tra cứu)
+- Xác nhận thông tin từ lịch sử chat
+
+OUTPUT: Chỉ trả về JSON format:
+{"route": "direct", "reason": "..."} HOẶC {"route": "rag", "reason": "..."}"""
+
+
+_BR_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
 
 
 def strip_html_tags(text: str) -> str:
@@ -16,19 +73,54 @@ def strip_html_tags(text: str) -> str:
     if not text:
         return ""
     
-    # Replace <br> and <br/> with newlines (preserve line breaks)
-    clean = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
+    clean = text
+    # Most responses contain no markup at all - skip both regex passes
+    if '<' in clean:
+        # Replace <br> and <br/> with newlines (preserve line breaks)
+        clean = _BR_RE.sub('\n', clean)
+        
+        # Remove other HTML tags
+        clean = _TAG_RE.sub('', clean)
     
-    # Remove other HTML tags
-    clean = re.sub(r'<[^>]+>', '', clean)
+    # Single line: nothing to clean up between lines
+    if '\n' not in clean:
+        return clean.strip()
     
     # Clean up excessive whitespace (but preserve newlines)
-    lines = [line.strip() for line in clean.split('\n')]
-    clean = '\n'.join(line for line in lines if line)
+    stripped = (line.strip() for line in clean.split('\n'))
+    clean = '\n'.join(line for line in stripped if line)
     
     return clean.strip()
 
 
+def strip_html_stream(chunks: Iterable[str], max_tag_length: int = 64) -> Iterator[str]:
+    """
+    Incremental strip_html_tags for streamed text
+    
+    Text from an unclosed '<' onwards is held back until the tag
+    completes, so tags split across chunks are still removed. A '<' that
+    stays open for more than max_tag_length chars is treated as plain
+    text. Per-line whitespace clean-up is not applied.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        cut = pending.rfind('<')
+        if cut != -1 and '>' not in pending[cut:] and len(pending) - cut <= max_tag_length:
+            ready, pending = pending[:cut], pending[cut:]
+        else:
+            ready, pending = pending, ""
+        if ready:
+            yield _TAG_RE.sub('', _BR_RE.sub('\n', ready))
+    if pending:
+        yield _TAG_RE.sub('', _BR_RE.sub('\n', pending))
+
+
+def _extra_params(response_format: Optional[Dict]) -> Dict:
+    """Optional create() kwargs - only sent when set, for providers that reject nulls"""
+    return {"response_format": response_format} if response_format else {}
+
+
 class MegLLMClient:
     """Client for MegLLM API (OpenAI-compatible)"""
     
@@ -37,7 +129,9 @@ class MegLLMClient:
         api_key: str,
         base_url: str = "https://ai.megallm.io/v1",
         model: str = "qwen/qwen3-next-80b-a3b-instruct",
-        timeout: int = 60
+        timeout: int = 60,
+        cache_size: int = 4096,
+        semantic_cache: Optional[SemanticCache] = None
     ):
         """
         Initialize MegLLM client
@@ -47,19 +141,51 @@ class MegLLMClient:
             base_url: API base URL
             model: Model name
             timeout: Request timeout
+            cache_size: Number of exact-match responses kept (LRU)
+            semantic_cache: Optional cache for paraphrased questions
         """
+        # Pooled keep-alive HTTP/2 connections instead of a TLS handshake per request
+        limits = httpx.Limits(
+            max_keepalive_connections=100,
+            max_connections=200,
+            keepalive_expiry=30
+        )
         self.client = OpenAI(
             base_url=base_url,
             api_key=api_key,
-            timeout=timeout
+            timeout=timeout,
+            http_client=httpx.Client(http2=True, timeout=timeout, limits=limits)
+        )
+        # Used by the async API endpoints so LLM calls don't block the loop
+        self.async_client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            http_client=httpx.AsyncClient(http2=True, timeout=timeout, limits=limits)
         )
         self.model = model
+        self.response_cache = LRUCache(maxsize=cache_size)
+        self.routing_cache = LRUCache(maxsize=cache_size)
+        self.semantic_cache = semantic_cache
+        # achat() requests currently awaiting the API, by request key
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+    
+    def close(self):
+        """Close the sync HTTP client and release its connections"""
+        self.client.close()
+    
+    async def aclose(self):
+        """Close both HTTP clients (call from the event loop)"""
+        self.client.close()
+        await self.async_client.close()
     
     def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        cache: bool = False,
+        response_format: Optional[Dict] = None
     ) -> str:
         """
         Chat completion
@@ -68,20 +194,185 @@ class MegLLMClient:
             messages: List of {role: "system"|"user"|"assistant", content: str}
             temperature: Sampling temperature
             max_tokens: Max response tokens
+            cache: Reuse the response for byte-identical requests (use for
+                deterministic, low-temperature prompts such as routing)
+            response_format: e.g. {"type": "json_object"} for JSON mode
             
         Returns:
             Response text (HTML tags removed)
         """
+        if cache:
+            key = hash_key(self.model, temperature, max_tokens, messages, response_format)
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        
         response = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            **_extra_params(response_format)
         )
         content = response.choices[0].message.content
         
         # Strip HTML tags that LLM sometimes generates
-        return strip_html_tags(content)
+        clean = strip_html_tags(content)
+        if cache:
+            self.response_cache.put(key, clean)
+        return clean
+    
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> Iterator[str]:
+        """
+        Chat completion streamed as it is generated
+        
+        Args:
+            messages: List of {role: "system"|"user"|"assistant", content: str}
+            temperature: Sampling temperature
+            max_tokens: Max response tokens
+            
+        Yields:
+            Response text chunks (HTML tags removed)
+        """
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        deltas = (
+            chunk.choices[0].delta.content
+            for chunk in stream
+            if chunk.choices and chunk.choices[0].delta.content
+        )
+        yield from strip_html_stream(deltas)
+    
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        cache: bool = False,
+        response_format: Optional[Dict] = None
+    ) -> str:
+        """
+        Async version of chat() for use inside the event loop
+        
+        Args:
+            messages: List of {role: "system"|"user"|"assistant", content: str}
+            temperature: Sampling temperature
+            max_tokens: Max response tokens
+            cache: Reuse the response for byte-identical requests
+            response_format: e.g. {"type": "json_object"} for JSON mode
+            
+        Returns:
+            Response text (HTML tags removed)
+        """
+        key = hash_key(self.model, temperature, max_tokens, messages, response_format)
+        if cache:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        # Identical request already in flight: wait for its answer instead
+        # of calling the API again (no await between check and insert, so
+        # this is race-free on the event loop)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        # Mark errors as retrieved even when nobody else was waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **_extra_params(response_format)
+            )
+            content = response.choices[0].message.content
+            
+            clean = strip_html_tags(content)
+            if cache:
+                self.response_cache.put(key, clean)
+            future.set_result(clean)
+            return clean
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+    
+    def _semantic_scope(
+        self,
+        messages: List[Dict[str, str]],
+        question: str,
+        temperature: float,
+        max_tokens: int
+    ) -> str:
+        """Exact part of a semantic cache key: everything but the question"""
+        return hash_key(self.model, temperature, max_tokens, [
+            (m.get("content") or "").replace(question, "") for m in messages
+        ])
+    
+    def _chat_semantic(
+        self,
+        messages: List[Dict[str, str]],
+        question: str,
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> str:
+        """
+        chat() behind the semantic cache
+        
+        Everything except the question (model, sampling params, system
+        prompt, history, context) must match exactly; the question itself
+        only has to be a close paraphrase. Without a semantic cache, only
+        byte-identical requests reuse an answer.
+        """
+        if self.semantic_cache is None:
+            return self.chat(messages, temperature=temperature, max_tokens=max_tokens, cache=True)
+        
+        scope = self._semantic_scope(messages, question, temperature, max_tokens)
+        cached = self.semantic_cache.check(scope, question)
+        if cached is not None:
+            return cached
+        
+        answer = self.chat(messages, temperature=temperature, max_tokens=max_tokens)
+        self.semantic_cache.store(scope, question, answer)
+        return answer
+    
+    async def _achat_semantic(
+        self,
+        messages: List[Dict[str, str]],
+        question: str,
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> str:
+        """Async version of _chat_semantic() (embedding runs in a thread)"""
+        if self.semantic_cache is None:
+            return await self.achat(messages, temperature=temperature, max_tokens=max_tokens, cache=True)
+        
+        scope = self._semantic_scope(messages, question, temperature, max_tokens)
+        cached = await asyncio.to_thread(self.semantic_cache.check, scope, question)
+        if cached is not None:
+            return cached
+        
+        answer = await self.achat(messages, temperature=temperature, max_tokens=max_tokens)
+        await asyncio.to_thread(self.semantic_cache.store, scope, question, answer)
+        return answer
     
     def answer_question(
         self,
@@ -100,10 +391,28 @@ class MegLLMClient:
         Returns:
             Answer text
         """
+        messages = self._answer_messages(question, context, system_prompt)
+        return self._chat_semantic(messages, question)
+    
+    async def aanswer_question(
+        self,
+        question: str,
+        context: str,
+        system_prompt: Optional[str] = None
+    ) -> str:
+        """Async version of answer_question()"""
+        messages = self._answer_messages(question, context, system_prompt)
+        return await self._achat_semantic(messages, question)
+    
+    def _answer_messages(
+        self,
+        question: str,
+        context: str,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Build the prompt used by answer_question()"""
         if not system_prompt:
-            system_prompt = """Bạn là trợ lý AI chuyên về dược liệu Việt Nam.
-Nhiệm vụ của bạn là trả lời câu hỏi dựa trên thông tin được cung cấp.
-Trả lời chính xác, ngắn gọn, dễ hiểu bằng tiếng Việt."""
+            system_prompt = ANSWER_SYSTEM_PROMPT
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -114,7 +423,7 @@ Trả lời chính xác, ngắn gọn, dễ hiểu bằng tiếng Việt."""
 Hãy trả lời câu hỏi: {question}"""}
         ]
         
-        return self.chat(messages)
+        return messages
     
     def answer_with_history(
         self,
@@ -135,25 +444,49 @@ Hãy trả lời câu hỏi: {question}"""}
         Returns:
             Answer text
         """
+        messages = self._history_messages(question, context, conversation_history, system_prompt)
+        return self._chat_semantic(messages, question, temperature=0.3)  # Lower temperature for less hallucination
+    
+    def answer_with_history_stream(
+        self,
+        question: str,
+        context: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Streaming version of answer_with_history()
+        
+        A semantic cache hit is yielded in one piece; otherwise chunks are
+        yielded as generated and the full answer is cached at the end.
+        """
+        messages = self._history_messages(question, context, conversation_history, system_prompt)
+        if self.semantic_cache is None:
+            yield from self.chat_stream(messages, temperature=0.3)
+            return
+        
+        scope = self._semantic_scope(messages, question, 0.3, 2000)
+        cached = self.semantic_cache.check(scope, question)
+        if cached is not None:
+            yield cached
+            return
+        
+        parts = []
+        for chunk in self.chat_stream(messages, temperature=0.3):
+            parts.append(chunk)
+            yield chunk
+        self.semantic_cache.store(scope, question, strip_html_tags("".join(parts)))
+    
+    def _history_messages(
+        self,
+        question: str,
+        context: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Build the prompt used by answer_with_history()"""
         if not system_prompt:
-            system_prompt = """Bạn là trợ lý AI chuyên về dược liệu Việt Nam.
-
-NHIỆM VỤ:
-- Trả lời câu hỏi CHÍNH XÁC dựa HOÀN TOÀN trên thông tin được cung cấp
-- Nhớ và sử dụng thông tin từ cuộc trò chuyện trước đó
-
-QUY TẮC QUAN TRỌNG:
-1. CHỈ sử dụng thông tin có trong "Thông tin dược liệu liên quan" để trả lời
-2. KHÔNG đưa ra thông tin bạn không chắc chắn hoặc không có trong context
-3. NẾU thông tin không có trong context, hãy thẳng thắn nói: "Xin lỗi, tôi không tìm thấy thông tin về [tên cây/câu hỏi] trong cơ sở dữ liệu."
-4. KHÔNG bịa đặt, suy luận, hoặc đưa ra thông tin từ kiến thức chung
-5. NẾU context trống hoặc không liên quan đến câu hỏi, hãy nói: "Tôi không có thông tin về câu hỏi này."
-
-PHONG CÁCH:
-- Thân thiện, lịch sự
-- Chính xác, có căn cứ từ context
-- Ngắn gọn, dễ hiểu bằng tiếng Việt
-- Thẳng thắn thừa nhận khi không biết"""
+            system_prompt = ANSWER_WITH_HISTORY_SYSTEM_PROMPT
         
         messages = [{"role": "system", "content": system_prompt}]
         
@@ -172,7 +505,7 @@ LƯU Ý: Chỉ trả lời dựa trên "Thông tin dược liệu liên quan" 
         
         messages.append({"role": "user", "content": user_content})
         
-        return self.chat(messages, temperature=0.3)  # Lower temperature for less hallucination
+        return messages
     
     def route_query(self, question: str, conversation_history: List[Dict[str, str]] = None) -> Dict[str, str]:
         """
@@ -188,26 +521,7 @@ LƯU Ý: Chỉ trả lời dựa trên "Thông tin dược liệu liên quan" 
                 "reason": str
             }
         """
-        system_prompt = """Bạn là chuyên gia phân loại câu hỏi về dược liệu Việt Nam.
-
-NHIỆM VỤ: Xác định câu hỏi cần tra cứu database (RAG) hay có thể trả lời trực tiếp.
-
-CẦN RAG khi:
-- Hỏi về cây cụ thể (tên, công dụng, cách dùng)
-- Tìm cây chữa bệnh cụ thể
-- So sánh nhiều loại cây
-- Câu hỏi chi tiết về dược liệu
-
-TRẢ LỜI TRỰC TIẾP khi:
-- Chào hỏi, giới thiệu
-- Hỏi về khả năng/chức năng của AI
-- Câu hỏi general (không cần tra cứu)
-- Xác nhận thông tin từ lịch sử chat
-
-OUTPUT: Chỉ trả về JSON format:
-{"route": "direct", "reason": "..."} HOẶC {"route": "rag", "reason": "..."}"""
-
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": ROUTE_SYSTEM_PROMPT}]
         
         # Add history for context
         if conversation_history:
@@ -218,15 +532,31 @@ OUTPUT: Chỉ trả về JSON format:
             "content": f"Phân loại câu hỏi: {question}"
         })
         
+        cache_key = hash_key(messages)
+        cached = self.routing_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        fallback = {"route": "rag", "reason": "Unable to classify, using RAG for safety"}
         try:
-            response = self.chat(messages, temperature=0.1, max_tokens=100)
+            response = self.chat(
+                messages,
+                temperature=0.0,
+                max_tokens=100,  # Room for the one-line "reason"
+                response_format={"type": "json_object"}
+            )
             # Parse JSON
-            import json
-            result = json.loads(response)
-            return result
-        except:
+            result = orjson.loads(response)
+        except Exception:
             # Default to RAG on error
-            return {"route": "rag", "reason": "Unable to classify, using RAG for safety"}
+            return fallback
+        
+        if not (isinstance(result, dict) and result.get("route") in ("direct", "rag")):
+            # Parsed, but not a routing decision
+            return fallback
+        # Only valid decisions are cached, never the fallback
+        self.routing_cache.put(cache_key, result)
+        return dict(result)
 
 
 # Singleton
@@ -238,6 +568,19 @@ def get_megllm_client() -> MegLLMClient:
     if _megllm_client is None:
         from config import get_settings
         settings = get_settings()
-        _megllm_client = MegLLMClient(api_key=settings.megllm_api_key)
+        semantic_cache = None
+        if settings.llm_semantic_cache:
+            from services.embedding_service import get_embedding_service
+            embed_service = get_embedding_service()
+            semantic_cache = SemanticCache(
+                embed=embed_service.embed_query,
+                distance_threshold=settings.llm_semantic_cache_threshold
+            )
+        _megllm_client = MegLLMClient(
+            api_key=settings.megllm_api_key,
+            cache_size=settings.llm_cache_size,
+            semantic_cache=semantic_cache
+        )
+        atexit.register(_megllm_client.close)
     return _megllm_client
 
@@ -2,10 +2,20 @@
 OG-RAG Query Engine Service
 Wrapper around Supabase vector search for semantic retrieval
 """
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
+import numpy as np
 from services.embedding_service import VietnameseEmbeddingService
+from services.llm_cache import SemanticCache, hash_key
 from services.vector_db_service import SupabaseVectorDB
 
+log = logging.getLogger("ograg")
+
+# Weight of key similarity in the combined score; value similarity gets the rest
+KEY_WEIGHT = 0.3
+
 
 class OGRAGQueryEngine:
     """OG-RAG query engine using HyperGraph in Supabase"""
@@ -15,7 +25,8 @@ class OGRAGQueryEngine:
         embed_service: VietnameseEmbeddingService,
         vector_db: SupabaseVectorDB,
         top_k: int = 20,
-        similarity_threshold: float = 0.3  # Lowered from 0.5 to allow less strict matching
+        similarity_threshold: float = 0.3,  # Lowered from 0.5 to allow less strict matching
+        result_cache: Optional[SemanticCache] = None
     ):
         """
         Initialize OG-RAG query engine
@@ -25,11 +36,15 @@ class OGRAGQueryEngine:
             vector_db: Vector database service
             top_k: Number of results to retrieve
             similarity_threshold: Minimum similarity score
+            result_cache: Optional cache of results for near-identical queries
         """
         self.embed_service = embed_service
         self.vector_db = vector_db
         self.top_k = top_k
         self.similarity_threshold = similarity_threshold
+        self.result_cache = result_cache
+        # Runs the key and value searches of a query side by side
+        self._search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ograg-search")
     
     def query(
         self,
@@ -53,43 +68,134 @@ class OGRAGQueryEngine:
             List of relevant HyperNodes with combined similarity scores
         """
         k = top_k or self.top_k
-        query_embedding = self.embed_service.embed_text(query_text)
+        # Cached per query string by the embedding service: repeated
+        # (reformulated) queries skip the forward pass
+        query_vector = self.embed_service.embed_query(query_text)
+        
+        # Near-identical query with the same k / filter: skip both searches
+        if self.result_cache is not None:
+            cache_scope = hash_key(k, plant_filter)
+            cached = self.result_cache.check_vector(cache_scope, query_vector)
+            if cached is not None:
+                log.debug("Cache hit: returning %d nodes", len(cached))
+                # Per-node copies: callers may annotate the nodes they get
+                return [dict(node) for node in cached]
+        
+        # Both stages plus the merge in one RPC (one round trip)
+        log.debug("Stage 1+2: searching by KEY and VALUE embeddings (k=%d, plant_filter=%s)", k, plant_filter)
+        combined = self.vector_db.search_key_and_value(
+            query_embedding=query_vector,
+            top_k=k,  # Each stage fetches k*3 server-side
+            threshold=self.similarity_threshold,
+            key_weight=KEY_WEIGHT,
+            plant_filter=plant_filter
+        )
+        if combined is not None:
+            for node in combined:
+                node['combined_score'] = node['similarity']
+        else:
+            combined = self._two_stage_search(query_vector, k, plant_filter)
+        
+        log.debug("Final: returning %d nodes after merge", len(combined))
+        if self.result_cache is not None:
+            self.result_cache.store_vector(cache_scope, query_vector, [dict(node) for node in combined])
+        return combined
+    
+    def query_batch(
+        self,
+        queries: List[str],
+        top_k: Optional[int] = None,
+        plant_filters: Optional[List[Optional[str]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Run several queries concurrently and merge their results
+        
+        Args:
+            queries: Query strings (e.g. one per plant of a comparison)
+            top_k: Override default top_k, per query
+            plant_filters: Plant filter per query (None: no filters)
+            
+        Returns:
+            Results of all queries in query order, without duplicate nodes
+        """
+        if not queries:
+            return []
+        if plant_filters is None:
+            plant_filters = [None] * len(queries)
+        
+        # One batched forward pass for all uncached queries; query() then
+        # finds every embedding in the cache
+        self.embed_service.embed_queries(queries)
+        
+        # The searches are independent and I/O-bound
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            all_results = executor.map(self.query, queries, [top_k] * len(queries), plant_filters)
+            
+            merged = []
+            seen_ids = set()
+            for results in all_results:
+                for node in results:
+                    if node['id'] not in seen_ids:
+                        seen_ids.add(node['id'])
+                        merged.append(node)
+        return merged
+    
+    def _two_stage_search(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        plant_filter: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """Key and value searches as two RPCs, merged client-side (databases without the combined RPC)"""
+        # The two stages are independent network calls - run them concurrently
         
         # STAGE 1: Search by KEY (attribute names)
         # This finds relevant attributes like "Công dụng y học", "Phân bố", etc.
-        # REDUCED multiplier to 2x (was 3x) to avoid timeout with 21k+ nodes
-        print(f"[OG-RAG] Stage 1: Searching by KEY embeddings...")
-        key_results = self.vector_db.search_by_key(
+        key_future = self._search_pool.submit(
+            self.vector_db.search_by_key,
             query_embedding=query_embedding,
-            top_k=k * 2,  # Reduced from k*3 to avoid timeout
+            top_k=k * 3,  # Candidates per stage (HNSW-indexed)
             threshold=self.similarity_threshold,
             plant_filter=plant_filter
         )
-        print(f"[OG-RAG] Stage 1: Found {len(key_results)} nodes by key")
         
         # STAGE 2: Search by VALUE (attribute content)
         # This finds relevant content regardless of attribute type
-        # REDUCED multiplier to 2x (was 3x) to avoid timeout
-        print(f"[OG-RAG] Stage 2: Searching by VALUE embeddings...")
-        value_results = self.vector_db.search_by_value(
+        value_future = self._search_pool.submit(
+            self.vector_db.search_by_value,
             query_embedding=query_embedding,
-            top_k=k * 2,  # Reduced from k*3 to avoid timeout
+            top_k=k * 3,  # Candidates per stage (HNSW-indexed)
             threshold=self.similarity_threshold,
             plant_filter=plant_filter
         )
-        print(f"[OG-RAG] Stage 2: Found {len(value_results)} nodes by value")
+        
+        key_results = key_future.result()
+        value_results = value_future.result()
+        log.debug("Stage 1: found %d nodes by key", len(key_results))
+        log.debug("Stage 2: found %d nodes by value", len(value_results))
         
         # MERGE & RE-RANK: Combine results with weighted scoring
-        combined = self._merge_and_rerank(
+        return self._merge_and_rerank(
             key_results=key_results,
             value_results=value_results,
             top_k=k,
-            key_weight=0.3,  # Keys are important for filtering
-            value_weight=0.7  # Values are more important for content
+            key_weight=KEY_WEIGHT,  # Keys are important for filtering
+            value_weight=1 - KEY_WEIGHT  # Values are more important for content
         )
+    
+    async def aquery(
+        self,
+        query_text: str,
+        top_k: Optional[int] = None,
+        plant_filter: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of query() for use inside the event loop
         
-        print(f"[OG-RAG] Final: Returning {len(combined)} nodes after merge\n")
-        return combined
+        Embedding and the Supabase client are blocking, so the whole
+        retrieval runs in a worker thread.
+        """
+        return await asyncio.to_thread(self.query, query_text, top_k, plant_filter)
     
     def _merge_and_rerank(
         self,
@@ -115,50 +221,61 @@ class OGRAGQueryEngine:
         Returns:
             Merged and re-ranked list of nodes
         """
-        # Build index by node ID
-        nodes = {}
+        # Dense index per node ID (first seen first); nodes found by key keep
+        # the key result's fields, value-only nodes the first value result's
+        index: Dict[Any, int] = {}
+        base_nodes = []
+        key_sims = []
+        value_sims = []
+        
+        def slot(node_id) -> int:
+            i = index.setdefault(node_id, len(base_nodes))
+            if i == len(base_nodes):
+                base_nodes.append(None)
+                key_sims.append(0)
+                value_sims.append(0)
+            return i
         
         # Add key results
         for node in key_results:
-            node_id = node['id']
-            nodes[node_id] = {
-                **node,
-                'key_similarity': node.get('similarity', 0),
-                'value_similarity': 0,
-                'combined_score': 0
-            }
+            i = slot(node['id'])
+            base_nodes[i] = node
+            key_sims[i] = node.get('similarity', 0)
         
         # Add/update value results
         for node in value_results:
-            node_id = node['id']
-            if node_id in nodes:
-                # Node found in both searches - update value similarity
-                nodes[node_id]['value_similarity'] = node.get('similarity', 0)
-            else:
+            i = slot(node['id'])
+            if base_nodes[i] is None:
                 # New node from value search only
-                nodes[node_id] = {
-                    **node,
-                    'key_similarity': 0,
-                    'value_similarity': node.get('similarity', 0),
-                    'combined_score': 0
-                }
-        
-        # Calculate combined scores
-        for node_id, node in nodes.items():
-            key_sim = node['key_similarity']
-            val_sim = node['value_similarity']
-            node['combined_score'] = key_weight * key_sim + value_weight * val_sim
-            # Keep original similarity for backward compatibility
-            node['similarity'] = node['combined_score']
+                base_nodes[i] = node
+            value_sims[i] = node.get('similarity', 0)
         
-        # Sort by combined score and return top-k
-        sorted_nodes = sorted(
-            nodes.values(),
-            key=lambda x: x['combined_score'],
-            reverse=True
-        )
+        # Calculate combined scores in one vector op
+        combined = (key_weight * np.asarray(key_sims, dtype=np.float64)
+                    + value_weight * np.asarray(value_sims, dtype=np.float64))
+        
+        # Top-k selection: partition for the k-th best score (O(n)), then
+        # stable-sort only the nodes scoring at least that much (ties keep
+        # first-seen order, like sorted(reverse=True))
+        candidates = np.arange(len(combined))
+        if 0 < top_k < len(combined):
+            kth_score = -np.partition(-combined, top_k - 1)[top_k - 1]
+            candidates = np.flatnonzero(combined >= kth_score)
+        order = candidates[np.argsort(-combined[candidates], kind='stable')][:top_k]
         
-        return sorted_nodes[:top_k]
+        # Search results are fresh per call, so the winners are scored in
+        # place instead of being copied (query() caches copies of them)
+        ranked = []
+        for i in order:
+            node = base_nodes[i]
+            score = float(combined[i])
+            node['key_similarity'] = key_sims[i]
+            node['value_similarity'] = value_sims[i]
+            node['combined_score'] = score
+            # Keep original similarity for backward compatibility
+            node['similarity'] = score
+            ranked.append(node)
+        return ranked
     
     def get_plant_context(self, plant_name: str) -> Dict[str, Any]:
         """
@@ -170,9 +287,27 @@ class OGRAGQueryEngine:
         Returns:
             Dictionary with all plant information organized by sections
         """
-        nodes = self.vector_db.get_plant_nodes(plant_name)
+        return self.get_plants_context([plant_name])[plant_name]
+    
+    def get_plants_context(self, plant_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get full context for several plants with one database request
         
-        # Organize by section
+        Args:
+            plant_names: Plant names (Vietnamese)
+            
+        Returns:
+            Plant name -> context as returned by get_plant_context()
+        """
+        nodes_by_plant = self.vector_db.get_plants_nodes_batch(plant_names)
+        return {
+            plant_name: self._organize_by_section(plant_name, nodes)
+            for plant_name, nodes in nodes_by_plant.items()
+        }
+    
+    @staticmethod
+    def _organize_by_section(plant_name: str, nodes: List[Dict]) -> Dict[str, Any]:
+        """Group a plant's nodes by section"""
         context = {
             "plant_name": plant_name,
             "sections": {}
@@ -180,10 +315,7 @@ class OGRAGQueryEngine:
         
         for node in nodes:
             section = node.get('section', 'General')
-            if section not in context['sections']:
-                context['sections'][section] = []
-            
-            context['sections'][section].append({
+            context['sections'].setdefault(section, []).append({
                 "key": node['key'],
                 "value": node['value'],
                 "is_chunked": node.get('is_chunked', False),
@@ -211,31 +343,25 @@ class OGRAGQueryEngine:
         current_length = 0
         
         # Group by plant
-        plants = {}
+        plants: Dict[str, List[Dict[str, Any]]] = {}
         for result in query_results:
-            plant_name = result['plant_name']
-            if plant_name not in plants:
-                plants[plant_name] = []
-            plants[plant_name].append(result)
+            plants.setdefault(result['plant_name'], []).append(result)
         
-        # Build context
+        # Build context (lines collected per plant and joined once)
         for plant_name, nodes in plants.items():
-            plant_context = f"\n## {plant_name}\n"
+            plant_lines = [f"\n## {plant_name}\n"]
             
             for node in nodes:
-                section = node.get('section', '')
-                key = node['key']
-                value = node['value']
-                
-                node_text = f"- **{key}** ({section}): {value}\n"
+                node_text = f"- **{node['key']}** ({node.get('section', '')}): {node['value']}\n"
                 
+                # Budget stays in characters, as before
                 if current_length + len(node_text) > max_context_length:
                     break
                 
-                plant_context += node_text
+                plant_lines.append(node_text)
                 current_length += len(node_text)
             
-            context_parts.append(plant_context)
+            context_parts.append("".join(plant_lines))
             
             if current_length >= max_context_length:
                 break
@@ -248,4 +374,15 @@ def get_og_rag_engine(
     vector_db: SupabaseVectorDB
 ) -> OGRAGQueryEngine:
     """Factory function for OG-RAG engine"""
-    return OGRAGQueryEngine(embed_service, vector_db)
+    from config import get_settings
+    settings = get_settings()
+    result_cache = None
+    if settings.rag_cache:
+        # Scopes are (top_k, plant_filter) - few of them, each holding many queries
+        result_cache = SemanticCache(
+            distance_threshold=1.0 - settings.rag_cache_similarity,
+            max_scopes=256,
+            max_entries_per_scope=settings.rag_cache_size,
+            ttl=settings.rag_cache_ttl
+        )
+    return OGRAGQueryEngine(embed_service, vector_db, result_cache=result_cache)
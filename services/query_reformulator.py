@@ -3,7 +3,10 @@ Smart Query Reformulation Service
 Intelligently reformulates user queries based on conversation context using LLM
 """
 from typing import List, Dict, Optional, Any
-import json
+import orjson
+import re
+from services.embedding_service import VietnameseEmbeddingService
+from services.llm_cache import LRUCache, SemanticCache, hash_key
 from services.llm_client import MegLLMClient
 
 
@@ -77,17 +80,44 @@ Output: {"intent": "comparison", "target_plants": ["Đậu bắp", "Rau má"], "
 """
 
 
+# Messages that are nothing but thanks / acknowledgement / greeting
+# ("Cảm ơn bạn!", "ok nhé", "Xin chào") - answered without reformulating.
+# Deliberately whole-message: "được", "hay" also occur in real questions.
+_CHITCHAT_ONLY_RE = re.compile(
+    r'(?:(?:cảm ơn|cám ơn|thanks|thank you|ok|okay|được rồi|tốt quá|hay quá|xin chào|chào|hello)'
+    r'(?:\s+(?:bạn|nhé|nha|ạ|nhiều|lắm))*[\s!.,?~]*)+',
+    re.IGNORECASE
+)
+
+# Outermost {...} block of a reformulation response
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Fallback heuristic: chitchat words anywhere in the query
+_CHITCHAT_RE = re.compile(r'\b(?:cảm ơn|thanks|ok|được|tốt|hay|xin chào)\b', re.IGNORECASE)
+
+
 class SmartQueryReformulator:
     """LLM-based intelligent query reformulation"""
     
-    def __init__(self, llm_client: MegLLMClient):
+    def __init__(
+        self,
+        llm_client: MegLLMClient,
+        cache_size: int = 1024,
+        semantic_cache: Optional[SemanticCache] = None
+    ):
         """
         Initialize reformulator
         
         Args:
             llm_client: LLM client for reformulation
+            cache_size: Reformulations kept per normalized query (LRU)
+            semantic_cache: Optional cache matching paraphrased queries
         """
         self.llm_client = llm_client
+        # Both keyed within (selected plant, conversation summary), so a
+        # follow-up never picks up another plant's or conversation's reading
+        self._cache = LRUCache(maxsize=cache_size)
+        self.semantic_cache = semantic_cache
     
     def reformulate(
         self,
@@ -113,10 +143,26 @@ class SmartQueryReformulator:
                 "reasoning": str
             }
         """
+        # Pure acknowledgements need no LLM round trip
+        if _CHITCHAT_ONLY_RE.fullmatch(current_query.strip()):
+            return self._chitchat_reformulation(current_query, "Acknowledgment, no information needed")
+        
+        history = conversation_history or []
+        plant_context = self._extract_plant_context(history[-6:])
+        
+        # Same query (up to case/spacing) in the same context: reuse
+        scope = hash_key(selected_plant, plant_context)
+        cache_key = hash_key(scope, " ".join(current_query.lower().split()))
+        cached = self._cache.get(cache_key)
+        if cached is None and self.semantic_cache is not None:
+            cached = self.semantic_cache.check(scope, current_query)
+        if cached is not None:
+            return self._copy_result(cached)
+        
         # Build reformulation request
         user_content = self._build_reformulation_request(
             current_query,
-            conversation_history or [],
+            plant_context,
             selected_plant
         )
         
@@ -128,7 +174,8 @@ class SmartQueryReformulator:
                     {"role": "user", "content": user_content}
                 ],
                 temperature=0.1,  # Low temperature for consistency
-                max_tokens=500
+                max_tokens=500,
+                cache=True
             )
             
             # Parse JSON response
@@ -137,7 +184,12 @@ class SmartQueryReformulator:
             # Validate and set defaults
             result = self._validate_reformulation(result, current_query, selected_plant)
             
-            return result
+            # Only LLM results are cached, never the heuristic fallback
+            self._cache.put(cache_key, result)
+            if self.semantic_cache is not None:
+                self.semantic_cache.store(scope, current_query, result)
+            
+            return self._copy_result(result)
             
         except Exception as e:
             # Fallback to simple heuristic
@@ -147,13 +199,10 @@ class SmartQueryReformulator:
     def _build_reformulation_request(
         self,
         query: str,
-        history: List[Dict[str, str]],
+        plant_context: str,
         selected_plant: Optional[str]
     ) -> str:
-        """Build the reformulation request context"""
-        
-        # Extract plant-relevant history (last 6 turns max)
-        plant_context = self._extract_plant_context(history[-6:] if history else [])
+        """Build the reformulation request context (plant_context from _extract_plant_context)"""
         
         # Build request
         request = {
@@ -175,41 +224,34 @@ Analyze and output JSON reformulation."""
         if not history:
             return "No previous conversation"
         
-        # Summarize last few messages
-        context_parts = []
-        for msg in history:
-            role = msg.get('role', 'user')
-            content = msg.get('content', '')
-            
-            # Keep it short
-            if len(content) > 100:
-                content = content[:100] + "..."
-            
-            context_parts.append(f"{role}: {content}")
-        
-        return " | ".join(context_parts[-4:])  # Last 4 messages
+        # Summarize the last 4 messages, each cut to 100 characters
+        return " | ".join(
+            f"{msg.get('role', 'user')}: {self._shorten(msg.get('content') or '')}"
+            for msg in history[-4:]
+        )
+    
+    @staticmethod
+    def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a cached result, lists included (e.g. target_plants), so callers can't alter the cache"""
+        return {k: list(v) if isinstance(v, list) else v for k, v in result.items()}
+    
+    @staticmethod
+    def _shorten(content: str, limit: int = 100) -> str:
+        """Content cut to limit characters (marked with "...")"""
+        return content if len(content) <= limit else content[:limit] + "..."
     
     def _parse_reformulation_response(self, response: str) -> Dict[str, Any]:
         """Parse LLM JSON response"""
-        # Try to extract JSON from response
         try:
-            # Remove markdown code blocks if present
-            cleaned = response.strip()
-            if cleaned.startswith("```"):
-                # Extract content between ```json and ```
-                lines = cleaned.split("\n")
-                json_lines = []
-                in_json = False
-                for line in lines:
-                    if line.startswith("```"):
-                        in_json = not in_json
-                        continue
-                    if in_json:
-                        json_lines.append(line)
-                cleaned = "\n".join(json_lines)
-            
-            return json.loads(cleaned)
-        except json.JSONDecodeError as e:
+            return orjson.loads(response)
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Markdown code fence or text around the object: take the {...} block
+        json_match = _JSON_BLOCK_RE.search(response)
+        try:
+            return orjson.loads(json_match.group() if json_match else response)
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Failed to parse JSON response: {e}\nResponse: {response}")
     
     def _validate_reformulation(
@@ -238,6 +280,18 @@ Analyze and output JSON reformulation."""
         
         return result
     
+    @staticmethod
+    def _chitchat_reformulation(query: str, reasoning: str) -> Dict[str, Any]:
+        """Reformulation result for a query that needs no RAG"""
+        return {
+            "intent": "chitchat",
+            "target_plants": [],
+            "excluded_plants": [],
+            "reformulated_query": query,
+            "needs_rag": False,
+            "reasoning": reasoning
+        }
+    
     def _fallback_reformulation(
         self,
         query: str,
@@ -249,18 +303,8 @@ Analyze and output JSON reformulation."""
         is_short = len(query.split()) <= 3
         
         # Check for chitchat patterns
-        chitchat_patterns = ["cảm ơn", "thanks", "ok", "được", "tốt", "hay", "xin chào"]
-        is_chitchat = any(pattern in query.lower() for pattern in chitchat_patterns)
-        
-        if is_chitchat:
-            return {
-                "intent": "chitchat",
-                "target_plants": [],
-                "excluded_plants": [],
-                "reformulated_query": query,
-                "needs_rag": False,
-                "reasoning": "Chitchat detected (fallback)"
-            }
+        if _CHITCHAT_RE.search(query):
+            return self._chitchat_reformulation(query, "Chitchat detected (fallback)")
         
         # If short query and have selected plant, add context
         if is_short and selected_plant:
@@ -285,6 +329,19 @@ Analyze and output JSON reformulation."""
         }
 
 
-def get_query_reformulator(llm_client: MegLLMClient) -> SmartQueryReformulator:
-    """Factory function for query reformulator"""
-    return SmartQueryReformulator(llm_client)
+def get_query_reformulator(
+    llm_client: MegLLMClient,
+    embed_service: Optional[VietnameseEmbeddingService] = None
+) -> SmartQueryReformulator:
+    """Factory function for query reformulator (semantic cache needs embed_service)"""
+    from config import get_settings
+    settings = get_settings()
+    semantic_cache = None
+    if embed_service is not None and settings.reformulation_semantic_cache:
+        semantic_cache = SemanticCache(
+            embed=embed_service.embed_query,
+            distance_threshold=1.0 - settings.reformulation_cache_similarity,
+            max_scopes=1024,
+            max_entries_per_scope=64
+        )
+    return SmartQueryReformulator(llm_client, semantic_cache=semantic_cache)
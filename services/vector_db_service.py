@@ -1,15 +1,69 @@
 """
 Supabase Vector Database Service for HyperNodes storage and retrieval
 """
-from supabase import create_client, Client
-from typing import List, Dict, Optional, Any
+from supabase import create_client, Client, ClientOptions
+from postgrest.utils import SyncClient
+from typing import List, Dict, Optional, Any, Set, Union
+import httpx
+import logging
+import numpy as np
+import orjson
 from functools import lru_cache
 
 
+log = logging.getLogger("vector_db")
+
+# Unique fingerprint of (plant_name, key, value), generated by the database;
+# inserts conflict on it to skip nodes that are already stored
+CONTENT_HASH_COLUMN = "content_hash"
+
+
+def _to_list(obj: Any) -> Any:
+    """orjson fallback for arrays it cannot write natively (e.g. non-contiguous)"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _to_payload(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert NumPy embeddings to plain lists for the JSON request body"""
+    return {
+        k: v.tolist() if hasattr(v, "tolist") else v
+        for k, v in node.items()
+    }
+
+
+def _vector_literal(embedding: Any) -> str:
+    """
+    pgvector text literal ("[0.1,0.2,...]") for an RPC vector argument
+    
+    supabase-py encodes RPC params with the stdlib json module; handing it
+    one pre-serialized string (orjson) instead of 1024 floats skips the
+    per-float repr. PostgREST casts the string to vector like an array.
+    """
+    return orjson.dumps(
+        embedding,
+        option=orjson.OPT_SERIALIZE_NUMPY,
+        default=_to_list
+    ).decode()
+
+
 class SupabaseVectorDB:
-    """Service for interacting with Supabase pgvector database"""
+    """
+    Service for interacting with Supabase pgvector database
+    
+    Safe to share between threads: searches only issue requests on the
+    pooled HTTP session. Use one instance per process (get_vector_db).
+    """
     
-    def __init__(self, url: str, key: str, timeout: int = 120):
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        timeout: int = 120,
+        max_connections: int = 64,
+        max_keepalive_connections: int = 32
+    ):
         """
         Initialize Supabase client with extended timeout
         
@@ -17,58 +71,151 @@ class SupabaseVectorDB:
             url: Supabase project URL
             key: Supabase anon key
             timeout: Request timeout in seconds (default: 120 for vector search)
+            max_connections: Concurrent PostgREST connections (requests beyond wait for one)
+            max_keepalive_connections: Idle connections kept open for reuse
         """
-        # Create client with default settings
-        # Note: Supabase Python client doesn't support custom timeout in options
-        # Timeout is handled at HTTP client level
-        self.client: Client = create_client(url, key)
+        self.client: Client = create_client(
+            url, key,
+            options=ClientOptions(postgrest_client_timeout=timeout)
+        )
+        # PostgREST already talks HTTP/2 over one session, but httpx drops idle
+        # connections after 5s - between user turns every RPC paid a new TLS
+        # handshake. Keep a larger pool alive across turns and users.
+        postgrest = self.client.postgrest
+        default_session = postgrest.session
+        postgrest.session = SyncClient(
+            base_url=default_session.base_url,
+            headers=default_session.headers,
+            timeout=timeout,
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=60
+            )
+        )
+        default_session.close()
+        self.url = url.rstrip('/')
+        self.key = key
         self.timeout = timeout
+        # Cleared if the database lacks match_hypernodes_key_and_value
+        self._has_key_and_value_rpc = True
         print(f"Connected to Supabase: {url} (timeout: {timeout}s)")
     
+    def close(self):
+        """Close pooled PostgREST connections"""
+        self.client.postgrest.session.close()
+    
     def insert_hypernode(self, node_data: Dict[str, Any]) -> Dict:
         """
-        Insert a single hypernode
+        Insert a single hypernode (no-op if an identical node exists)
         
         Args:
             node_data: Dictionary containing node data
                 Required fields: key, value, key_embedding, value_embedding, plant_name
                 
         Returns:
-            Inserted record
+            Inserted record, or None if the node was already stored
         """
-        result = self.client.table('hypernodes').insert(node_data).execute()
+        result = self.client.table('hypernodes').upsert(
+            _to_payload(node_data),
+            on_conflict=CONTENT_HASH_COLUMN,
+            ignore_duplicates=True
+        ).execute()
         return result.data[0] if result.data else None
     
     def insert_hypernodes_batch(self, nodes: List[Dict[str, Any]]) -> List[Dict]:
         """
         Insert multiple hypernodes in batch
         
+        Nodes already stored (same content hash) are skipped instead of
+        failing the whole batch.
+        
         Args:
             nodes: List of node data dictionaries
             
         Returns:
             List of inserted records
         """
-        result = self.client.table('hypernodes').insert(nodes).execute()
+        result = self.client.table('hypernodes').upsert(
+            [_to_payload(node) for node in nodes],
+            on_conflict=CONTENT_HASH_COLUMN,
+            ignore_duplicates=True
+        ).execute()
         return result.data
     
+    def async_rest_client(self) -> httpx.AsyncClient:
+        """
+        Async PostgREST client for bulk writes
+        
+        Use as `async with vector_db.async_rest_client() as client:` and
+        pass the client to insert_hypernodes_batch_async.
+        """
+        return httpx.AsyncClient(
+            base_url=f"{self.url}/rest/v1",
+            headers={
+                "apikey": self.key,
+                "Authorization": f"Bearer {self.key}",
+                "Content-Type": "application/json",
+                # Skip nodes already stored (ON CONFLICT DO NOTHING, see
+                # insert_hypernodes_batch_async); don't echo the vectors back
+                "Prefer": "resolution=ignore-duplicates,return=minimal"
+            },
+            timeout=self.timeout
+        )
+    
+    async def insert_hypernodes_batch_async(
+        self,
+        client: httpx.AsyncClient,
+        nodes: List[Dict[str, Any]]
+    ):
+        """
+        Insert multiple hypernodes in one PostgREST request (async)
+        
+        Nodes already stored (same content hash) are skipped instead of
+        failing the whole batch.
+        
+        Args:
+            client: Client from async_rest_client()
+            nodes: List of node data dictionaries
+        """
+        # orjson writes ndarray embeddings directly, without boxing floats
+        response = await client.post(
+            "/hypernodes",
+            params={"on_conflict": CONTENT_HASH_COLUMN},
+            content=orjson.dumps(
+                nodes,
+                option=orjson.OPT_SERIALIZE_NUMPY,
+                default=_to_list
+            )
+        )
+        if response.is_error:
+            # Keep the PostgREST message (e.g. "duplicate key") in the error
+            raise httpx.HTTPStatusError(
+                f"{response.status_code}: {response.text}",
+                request=response.request,
+                response=response
+            )
+    
     def search_by_key(
         self,
-        query_embedding: List[float],
+        query_embedding: Union[np.ndarray, List[float]],
         top_k: int = 10,  # Reduced from 20 for better performance
         threshold: float = 0.4,  # Lowered threshold
         plant_filter: Optional[str] = None,
-        retry_count: int = 2
+        retry_count: int = 0
     ) -> List[Dict]:
         """
         Search hypernodes by key embedding similarity with retry
         
         Args:
-            query_embedding: Query vector (1024 dim)
+            query_embedding: Query vector (1024 dim, float32 array or list)
             top_k: Number of results (default: 10 for performance)
             threshold: Minimum similarity threshold
             plant_filter: Optional plant name filter
-            retry_count: Number of retries on timeout
+            retry_count: Number of retries on timeout, each with half the top_k
+                (off by default: HNSW-indexed searches stay well under the timeout)
             
         Returns:
             List of matching hypernodes with similarity scores
@@ -77,7 +224,7 @@ class SupabaseVectorDB:
             try:
                 # Build RPC params
                 rpc_params = {
-                    'query_embedding': query_embedding,
+                    'query_embedding': _vector_literal(query_embedding),
                     'match_threshold': threshold,
                     'match_count': top_k
                 }
@@ -96,33 +243,34 @@ class SupabaseVectorDB:
                 return nodes
             except Exception as e:
                 if 'timeout' in str(e).lower() and attempt < retry_count:
-                    print(f"Timeout on attempt {attempt + 1}, retrying with reduced top_k...")
+                    log.warning("Timeout on attempt %d, retrying with reduced top_k...", attempt + 1)
                     top_k = max(5, top_k // 2)  # Reduce top_k on retry
                     continue
                 elif 'timeout' in str(e).lower():
                     # All retries failed - return empty instead of raising
-                    print(f"⚠️ All retries timed out. Returning empty results.")
+                    log.warning("All retries timed out. Returning empty results.")
                     return []
                 else:
                     raise
     
     def search_by_value(
         self,
-        query_embedding: List[float],
+        query_embedding: Union[np.ndarray, List[float]],
         top_k: int = 10,  # Reduced from 20
         threshold: float = 0.4,
         plant_filter: Optional[str] = None,
-        retry_count: int = 2
+        retry_count: int = 0
     ) -> List[Dict]:
         """
         Search hypernodes by value embedding similarity with retry
         
         Args:
-            query_embedding: Query vector (1024 dim)
+            query_embedding: Query vector (1024 dim, float32 array or list)
             top_k: Number of results (default: 10 for performance)
             threshold: Minimum similarity threshold  
             plant_filter: Optional plant name filter
-            retry_count: Number of retries on timeout
+            retry_count: Number of retries on timeout, each with half the top_k
+                (off by default: HNSW-indexed searches stay well under the timeout)
             
         Returns:
             List of matching hypernodes with similarity scores
@@ -131,7 +279,7 @@ class SupabaseVectorDB:
             try:
                 # Build RPC params
                 rpc_params = {
-                    'query_embedding': query_embedding,
+                    'query_embedding': _vector_literal(query_embedding),
                     'match_threshold': threshold,
                     'match_count': top_k
                 }
@@ -139,9 +287,6 @@ class SupabaseVectorDB:
                 # Add plant filter if specified
                 if plant_filter:
                     rpc_params['filter_plant_name'] = plant_filter
-                    print(f"[VectorDB] Calling RPC with plant_filter='{plant_filter}'")
-                else:
-                    print(f"[VectorDB] Calling RPC without plant_filter")
                 
                 result = self.client.rpc(
                     'match_hypernodes_by_value',
@@ -149,25 +294,88 @@ class SupabaseVectorDB:
                 ).execute()
                 
                 nodes = result.data
-                print(f"[VectorDB] RPC returned {len(nodes)} results")
+                log.debug("match_hypernodes_by_value (plant_filter=%s) returned %d results", plant_filter, len(nodes))
                 
                 return nodes
             except Exception as e:
-                print(f"[VectorDB ERROR] {type(e).__name__}: {str(e)}")
+                log.warning("match_hypernodes_by_value failed: %s: %s", type(e).__name__, e)
                 if 'timeout' in str(e).lower() and attempt < retry_count:
-                    print(f"Timeout on attempt {attempt + 1}, retrying with reduced top_k...")
+                    log.warning("Timeout on attempt %d, retrying with reduced top_k...", attempt + 1)
                     top_k = max(5, top_k // 2)  # Reduce top_k on retry
                     continue
                 elif 'timeout' in str(e).lower():
                     # All retries failed - return empty instead of raising
-                    print(f"⚠️ All retries timed out. Returning empty results.")
+                    log.warning("All retries timed out. Returning empty results.")
+                    return []
+                else:
+                    raise
+    
+    def search_key_and_value(
+        self,
+        query_embedding: Union[np.ndarray, List[float]],
+        top_k: int = 20,
+        threshold: float = 0.3,
+        key_weight: float = 0.3,
+        plant_filter: Optional[str] = None,
+        retry_count: int = 0
+    ) -> Optional[List[Dict]]:
+        """
+        Two-stage key + value search merged server-side, in one round trip
+        
+        Args:
+            query_embedding: Query vector (1024 dim, float32 array or list)
+            top_k: Number of merged results (each stage fetches top_k * 3)
+            threshold: Minimum similarity threshold for each stage
+            key_weight: Weight for key similarity (0-1), value gets (1-key_weight)
+            plant_filter: Optional plant name filter
+            retry_count: Number of retries on timeout, each with half the top_k
+                (off by default: HNSW-indexed searches stay well under the timeout)
+            
+        Returns:
+            Merged hypernodes with key_similarity, value_similarity and
+            combined similarity, or None if the database predates the
+            match_hypernodes_key_and_value function
+        """
+        if not self._has_key_and_value_rpc:
+            return None
+        
+        for attempt in range(retry_count + 1):
+            try:
+                rpc_params = {
+                    'query_embedding': _vector_literal(query_embedding),
+                    'match_threshold': threshold,
+                    'match_count': top_k,
+                    'key_weight': key_weight
+                }
+                if plant_filter:
+                    rpc_params['filter_plant_name'] = plant_filter
+                
+                result = self.client.rpc(
+                    'match_hypernodes_key_and_value',
+                    rpc_params
+                ).execute()
+                
+                return result.data
+            except Exception as e:
+                if getattr(e, 'code', None) == 'PGRST202':
+                    # PostgREST: function not found - run set_up_supabasedb.sql to add it
+                    log.warning("match_hypernodes_key_and_value not installed, using separate key/value searches")
+                    self._has_key_and_value_rpc = False
+                    return None
+                if 'timeout' in str(e).lower() and attempt < retry_count:
+                    log.warning("Timeout on attempt %d, retrying with reduced top_k...", attempt + 1)
+                    top_k = max(5, top_k // 2)  # Reduce top_k on retry
+                    continue
+                elif 'timeout' in str(e).lower():
+                    # All retries failed - return empty instead of raising
+                    log.warning("All retries timed out. Returning empty results.")
                     return []
                 else:
                     raise
     
     def search_combined(
         self,
-        query_embedding: List[float],
+        query_embedding: Union[np.ndarray, List[float]],
         top_k: int = 20,
         threshold: float = 0.5,
         key_weight: float = 0.5
@@ -187,7 +395,7 @@ class SupabaseVectorDB:
         result = self.client.rpc(
             'match_hypernodes_combined',
             {
-                'query_embedding': query_embedding,
+                'query_embedding': _vector_literal(query_embedding),
                 'match_threshold': threshold,
                 'match_count': top_k,
                 'key_weight': key_weight
@@ -213,14 +421,70 @@ class SupabaseVectorDB:
         
         return result.data
     
+    def get_plants_nodes_batch(
+        self,
+        plant_names: List[str],
+        columns: str = 'id, key, value, plant_name, section, chunk_id, is_chunked'
+    ) -> Dict[str, List[Dict]]:
+        """
+        Get the hypernodes of several plants in one request
+        
+        Args:
+            plant_names: Names of the plants
+            columns: Columns to select (default: everything but the embeddings)
+            
+        Returns:
+            Plant name -> its hypernodes (empty list for unknown plants)
+        """
+        nodes_by_plant: Dict[str, List[Dict]] = {name: [] for name in plant_names}
+        if not nodes_by_plant:
+            return nodes_by_plant
+        
+        result = self.client.table('hypernodes')\
+            .select(columns)\
+            .in_('plant_name', list(nodes_by_plant))\
+            .execute()
+        
+        for node in result.data:
+            nodes_by_plant[node['plant_name']].append(node)
+        return nodes_by_plant
+    
     def count_nodes(self) -> int:
         """Get total number of hypernodes in database"""
+        # HEAD request: PostgREST returns only the count, no rows
         result = self.client.table('hypernodes')\
-            .select('id', count='exact')\
+            .select('id', count='exact', head=True)\
             .execute()
         
         return result.count
     
+    def get_content_hashes(self, page_size: int = 1000) -> Set[str]:
+        """
+        Content hashes of every stored hypernode (for incremental imports)
+        
+        Pages through the table by id, since PostgREST caps rows per response.
+        
+        Args:
+            page_size: Rows per request (at most the server's max-rows)
+            
+        Returns:
+            Set of content_hash values
+        """
+        hashes: Set[str] = set()
+        last_id = 0
+        while True:
+            result = self.client.table('hypernodes')\
+                .select(f'id, {CONTENT_HASH_COLUMN}')\
+                .gt('id', last_id)\
+                .order('id')\
+                .limit(page_size)\
+                .execute()
+            rows = result.data
+            hashes.update(row[CONTENT_HASH_COLUMN] for row in rows)
+            if len(rows) < page_size:
+                return hashes
+            last_id = rows[-1]['id']
+    
     def clear_all_nodes(self):
         """Delete all hypernodes (use with caution!)"""
         result = self.client.table('hypernodes').delete().neq('id', 0).execute()
@@ -229,5 +493,5 @@ class SupabaseVectorDB:
 
 @lru_cache()
 def get_vector_db(url: str, key: str) -> SupabaseVectorDB:
-    """Get cached vector DB instance"""
+    """Get cached vector DB instance (one connection pool per process)"""
     return SupabaseVectorDB(url, key)
@@ -20,6 +20,7 @@
 CREATE EXTENSION IF NOT EXISTS vector;
 
 -- Drop existing objects if recreating (uncomment if needed for clean setup)
+-- DROP FUNCTION IF EXISTS match_hypernodes_key_and_value(vector, float, int, float, text);
 -- DROP FUNCTION IF EXISTS match_hypernodes_combined(vector, float, int, float);
 -- DROP FUNCTION IF EXISTS match_hypernodes_by_value(vector, float, int, text);
 -- DROP FUNCTION IF EXISTS match_hypernodes_by_key(vector, float, int, text);
@@ -43,6 +44,11 @@ CREATE TABLE IF NOT EXISTS hypernodes (
     chunk_id INTEGER DEFAULT 0,
     is_chunked BOOLEAN DEFAULT FALSE,
     
+    -- Content fingerprint for incremental imports (see utils/pg_copy.py)
+    content_hash TEXT GENERATED ALWAYS AS (
+        md5(plant_name || '|' || key || '|' || value)
+    ) STORED UNIQUE,
+    
     -- Timestamps
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
@@ -56,6 +62,22 @@ CREATE INDEX IF NOT EXISTS hypernodes_section_idx ON hypernodes(section);
 -- Case-insensitive plant name index for filtering
 CREATE INDEX IF NOT EXISTS hypernodes_plant_name_lower_idx ON hypernodes(LOWER(plant_name));
 
+-- HNSW indexes for the vector searches (approximate nearest neighbours
+-- instead of a full cosine scan over every node). Same names and parameters
+-- as utils/pg_copy.py, which drops and rebuilds them around bulk imports.
+CREATE INDEX IF NOT EXISTS hypernodes_key_embedding_idx ON hypernodes
+    USING hnsw (key_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX IF NOT EXISTS hypernodes_value_embedding_idx ON hypernodes
+    USING hnsw (value_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Existing databases: add the content hash column (backfilled automatically).
+-- Its UNIQUE constraint rejects duplicate nodes at insert time and lets
+-- imports skip already-indexed nodes with ON CONFLICT (content_hash) DO NOTHING.
+-- Run scripts/clean_duplicates.py first if the table may contain duplicates.
+ALTER TABLE hypernodes ADD COLUMN IF NOT EXISTS content_hash TEXT GENERATED ALWAYS AS (
+    md5(plant_name || '|' || key || '|' || value)
+) STORED UNIQUE;
+
 -- ============================================================================
 -- SECTION 3: CORE VECTOR SEARCH FUNCTIONS
 -- ============================================================================
@@ -169,6 +191,73 @@ AS $$
     LIMIT match_count;
 $$;
 
+-- Function: Two-Stage Key and Value Search (one round trip)
+-- Runs the key and value searches of OGRAGQueryEngine.query() server-side:
+-- each stage keeps its top (match_count * 3) nodes above the threshold, the
+-- two sets are merged by id (a stage that missed a node scores 0) and
+-- re-ranked by key_weight * key_sim + (1 - key_weight) * value_sim
+CREATE OR REPLACE FUNCTION match_hypernodes_key_and_value(
+    query_embedding vector(1024),
+    match_threshold float DEFAULT 0.3,
+    match_count int DEFAULT 20,
+    key_weight float DEFAULT 0.3,
+    filter_plant_name text DEFAULT NULL
+)
+RETURNS TABLE (
+    id bigint,
+    key text,
+    value text,
+    plant_name text,
+    section text,
+    key_similarity float,
+    value_similarity float,
+    similarity float
+)
+LANGUAGE SQL STABLE
+AS $$
+    WITH by_key AS (
+        SELECT
+            hypernodes.id,
+            1 - (hypernodes.key_embedding <=> query_embedding) as similarity
+        FROM hypernodes
+        WHERE 1 - (hypernodes.key_embedding <=> query_embedding) > match_threshold
+            AND (filter_plant_name IS NULL OR LOWER(hypernodes.plant_name) = LOWER(filter_plant_name))
+        ORDER BY hypernodes.key_embedding <=> query_embedding
+        LIMIT match_count * 3
+    ),
+    by_value AS (
+        SELECT
+            hypernodes.id,
+            1 - (hypernodes.value_embedding <=> query_embedding) as similarity
+        FROM hypernodes
+        WHERE 1 - (hypernodes.value_embedding <=> query_embedding) > match_threshold
+            AND (filter_plant_name IS NULL OR LOWER(hypernodes.plant_name) = LOWER(filter_plant_name))
+        ORDER BY hypernodes.value_embedding <=> query_embedding
+        LIMIT match_count * 3
+    ),
+    merged AS (
+        SELECT
+            COALESCE(by_key.id, by_value.id) as id,
+            COALESCE(by_key.similarity, 0) as key_similarity,
+            COALESCE(by_value.similarity, 0) as value_similarity
+        FROM by_key
+        FULL OUTER JOIN by_value ON by_key.id = by_value.id
+    )
+    SELECT
+        hypernodes.id,
+        hypernodes.key,
+        hypernodes.value,
+        hypernodes.plant_name,
+        hypernodes.section,
+        merged.key_similarity,
+        merged.value_similarity,
+        key_weight * merged.key_similarity + (1 - key_weight) * merged.value_similarity as similarity
+    FROM merged
+    JOIN hypernodes ON hypernodes.id = merged.id
+    ORDER BY similarity DESC, merged.key_similarity DESC
+    LIMIT match_count;
+$$;
+
 -- ============================================================================
 -- SECTION 4: PERFORMANCE OPTIMIZATION
 -- ============================================================================
@@ -177,6 +266,29 @@ $$;
 ALTER FUNCTION match_hypernodes_by_key SET statement_timeout = '30s';
 ALTER FUNCTION match_hypernodes_by_value SET statement_timeout = '30s';
 ALTER FUNCTION match_hypernodes_combined SET statement_timeout = '30s';
+ALTER FUNCTION match_hypernodes_key_and_value SET statement_timeout = '30s';
+
+-- HNSW search breadth: candidates visited per index scan (default 40).
+-- Must cover the largest LIMIT (match_count * 3 = 60 for top_k 20).
+ALTER FUNCTION match_hypernodes_by_key SET hnsw.ef_search = 100;
+ALTER FUNCTION match_hypernodes_by_value SET hnsw.ef_search = 100;
+ALTER FUNCTION match_hypernodes_key_and_value SET hnsw.ef_search = 100;
+
+-- Iterative scans keep scanning when the plant filter or threshold rejects
+-- candidates, so filtered searches still fill their LIMIT. The setting only
+-- exists in pgvector >= 0.8 (older versions reject it), so it is skipped there.
+DO $$
+BEGIN
+    IF (SELECT string_to_array(extversion, '.')::int[] >= ARRAY[0, 8]
+        FROM pg_extension WHERE extname = 'vector') THEN
+        ALTER FUNCTION match_hypernodes_by_key SET hnsw.iterative_scan = 'strict_order';
+        ALTER FUNCTION match_hypernodes_by_value SET hnsw.iterative_scan = 'strict_order';
+        ALTER FUNCTION match_hypernodes_key_and_value SET hnsw.iterative_scan = 'strict_order';
+    ELSE
+        RAISE NOTICE 'pgvector < 0.8: hnsw.iterative_scan not set';
+    END IF;
+END
+$$;
 
 -- Update table statistics for query optimizer
 ANALYZE hypernodes;
@@ -214,13 +326,17 @@ ANALYZE hypernodes;
 --     HAVING COUNT(*) > 1
 -- ) AS duplicates;
 
--- Delete duplicates (keeps lowest ID)
--- DELETE FROM hypernodes a
--- USING hypernodes b
--- WHERE a.id > b.id 
---   AND a.key = b.key 
---   AND a.value = b.value 
---   AND a.plant_name = b.plant_name;
+-- Delete duplicates (keeps lowest ID) - same statement as scripts/clean_duplicates.py
+-- DELETE FROM hypernodes
+-- WHERE id IN (
+--     SELECT id FROM (
+--         SELECT id, ROW_NUMBER() OVER (
+--             PARTITION BY key, value, plant_name ORDER BY id
+--         ) AS rn
+--         FROM hypernodes
+--     ) t
+--     WHERE rn > 1
+-- );
 
 -- -----------------------------------------------------------------------------
 -- 5.3 Clear All Data (USE WITH CAUTION!)
@@ -245,6 +361,7 @@ ANALYZE hypernodes;
 -- REINDEX INDEX hypernodes_plant_name_idx;
 -- REINDEX INDEX hypernodes_section_idx;
 -- REINDEX INDEX hypernodes_plant_name_lower_idx;
+-- REINDEX INDEX hypernodes_content_hash_key;
 
 -- Update statistics after rebuild
 -- ANALYZE hypernodes;
@@ -44,9 +44,7 @@ def test_embedding_service():
     print(f"Generated {len(batch_embeddings)} embeddings")
     
     # Test similarity
-    emb1 = embed_service.embed_text("chữa ho")
-    emb2 = embed_service.embed_text("trị ho")
-    emb3 = embed_service.embed_text("bổ thận")
+    emb1, emb2, emb3 = embed_service.embed_many(["chữa ho", "trị ho", "bổ thận"], show_progress_bar=False)
     
     sim_12 = embed_service.similarity(emb1, emb2)
     sim_13 = embed_service.similarity(emb1, emb3)
@@ -58,8 +56,8 @@ def test_embedding_service():
     return embed_service
 
 
-def test_vector_db():
-    """Test Supabase vector DB connection"""
+def test_vector_db(embed_service: VietnameseEmbeddingService = None):
+    """Test Supabase vector DB connection (reuses embed_service if given)"""
     print("\n=== Testing Supabase Vector DB ===")
     
     settings = get_settings()
@@ -74,7 +72,8 @@ def test_vector_db():
     
     # Test insert
     print("\nInserting test hypernode...")
-    embed_service = VietnameseEmbeddingService()
+    if embed_service is None:
+        embed_service = VietnameseEmbeddingService()
     
     test_node = {
         "key": "Tên",
@@ -88,7 +87,10 @@ def test_vector_db():
     }
     
     inserted = vector_db.insert_hypernode(test_node)
-    print(f"Inserted node ID: {inserted['id']}")
+    if inserted:
+        print(f"Inserted node ID: {inserted['id']}")
+    else:
+        print("Test node already present (left over from an earlier run)")
     
     # Test search
     print("\nTesting vector search...")
@@ -122,7 +124,7 @@ if __name__ == "__main__":
         embed_service = test_embedding_service()
         
         # Test vector DB
-        vector_db = test_vector_db()
+        vector_db = test_vector_db(embed_service)
         
         print("=" * 60)
         print("✅ ALL TESTS PASSED!")
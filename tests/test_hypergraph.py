@@ -3,6 +3,7 @@ Test OG-RAG Retrieval
 Verify HyperGraph indexing and test search functionality
 """
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -39,21 +40,26 @@ def test_hypergraph():
         "lợi tiểu tiêu sưng"
     ]
     
-    for query in test_queries:
+    # Embed all queries in one batched forward pass
+    query_embs = embed_service.embed_many(test_queries, show_progress_bar=False)
+    
+    # Search by value (most relevant for use cases) - the RPCs are
+    # independent, so run them concurrently; map keeps query order
+    with ThreadPoolExecutor(max_workers=len(test_queries)) as executor:
+        all_results = list(executor.map(
+            lambda query_emb: vector_db.search_by_value(
+                query_embedding=query_emb,
+                top_k=5,
+                threshold=0.5
+            ),
+            query_embs
+        ))
+    
+    for query, results in zip(test_queries, all_results):
         print(f"\n{'='*60}")
         print(f"Query: '{query}'")
         print(f"{'='*60}")
         
-        # Embed query
-        query_emb = embed_service.embed_text(query)
-        
-        # Search by value (most relevant for use cases)
-        results = vector_db.search_by_value(
-            query_embedding=query_emb,
-            top_k=5,
-            threshold=0.5
-        )
-        
         print(f"\nTop {len(results)} results:\n")
         for i, result in enumerate(results, 1):
             print(f"{i}. [Sim: {result['similarity']:.3f}] {result['plant_name']}")
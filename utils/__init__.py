@@ -1,11 +1,18 @@
 """Utils package"""
-from .key_normalizer import normalize_key, KEY_MAPPING
-from .chunker import chunk_long_value, estimate_tokens, split_into_sentences
+from .key_normalizer import normalize_key, normalize_keys_batch, KEY_MAPPING
+from .chunker import (
+    chunk_long_value, estimate_tokens, estimate_tokens_batch, count_tokens_batch,
+    fits_tokens, split_into_sentences
+)
 
 __all__ = [
     "normalize_key",
+    "normalize_keys_batch",
     "KEY_MAPPING", 
     "chunk_long_value",
     "estimate_tokens",
+    "estimate_tokens_batch",
+    "count_tokens_batch",
+    "fits_tokens",
     "split_into_sentences"
 ]
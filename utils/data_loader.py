@@ -2,10 +2,140 @@
 JSON-LD Data Loader
 Loads and processes plant ontology data from JSON-LD files
 """
-import json
+import orjson
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Any
-from functools import lru_cache
+
+
+# Parenthesized author citations in scientific names, e.g. "(L.)"
+_PARENS_RE = re.compile(r'\([^)]*\)')
+
+
+def load_jsonld_file(file_path: Path) -> Optional[Dict]:
+    """
+    Load and extract plant data from JSON-LD file
+    
+    Module-level so it can be pickled into worker processes.
+    
+    Merges ALL nodes from @graph into a single plant dictionary:
+    - Plant node (metadata)
+    - Mô tả node
+    - Phân bố node
+    - Công dụng node
+    - etc.
+    
+    Args:
+        file_path: Path to JSON-LD file
+        
+    Returns:
+        Complete plant data dictionary with all sections merged
+    """
+    try:
+        data = orjson.loads(Path(file_path).read_bytes())
+        
+        # Extract and merge all nodes from @graph
+        if "@graph" in data:
+            plant_data = {}
+            
+            for node in data["@graph"]:
+                if not isinstance(node, dict):
+                    continue
+                
+                node_type = node.get("@type")
+                
+                if node_type == "Plant":
+                    # Plant node is the base - copy all fields
+                    plant_data.update(node)
+                elif node_type:
+                    # Other nodes (Mô tả, Phân bố, Công dụng, etc.)
+                    # Add as a section with the @type as key; the node was
+                    # just parsed, so it becomes the section without a copy
+                    del node["@type"]
+                    
+                    # Skip if section is empty or all null
+                    if node and any(v is not None for v in node.values()):
+                        plant_data[node_type] = node
+            
+            return plant_data if plant_data else None
+        
+        # If @graph doesn't exist, check if it's the plant node directly
+        if data.get("@type") == "Plant":
+            return data
+            
+        return None
+    except Exception as e:
+        print(f"Error loading {file_path}: {e}")
+        return None
+
+
+# (section, summary key, max chars) - first non-empty item of each section
+_SUMMARY_FIELDS = (
+    ("Công dụng", "uses", 200),
+    ("Cách dùng", "usage", 150),
+    ("luu_y", "warnings", 150),
+)
+
+
+def build_plant_summary(plant_data: Dict) -> Dict:
+    """Generate concise summary from plant data (shown with Flow 1 predictions)"""
+    summary = {}
+    
+    # Description combines all parts of "Mô tả"
+    mo_ta = plant_data.get("Mô tả")
+    if mo_ta and isinstance(mo_ta, dict):
+        desc_parts = [f"{key.capitalize()}: {value}"
+                      for key, value in mo_ta.items() if value and str(value).strip()]
+        if desc_parts:
+            description = " ".join(desc_parts)
+            summary["description"] = description[:300] + ("..." if len(description) > 300 else "")
+    
+    # Other fields take the first non-empty item of their section
+    for section, summary_key, limit in _SUMMARY_FIELDS:
+        section_data = plant_data.get(section)
+        if not section_data or not isinstance(section_data, dict):
+            continue
+        value = next((v for v in section_data.values() if v), None)
+        if value:
+            summary[summary_key] = str(value)[:limit] + "..."
+    
+    return summary
+
+
+_CONTEXT_HEADER = "**Tên:** {ten}\n**Tên khoa học:** {ten_khoa_hoc}\n**Họ:** {ho}"
+
+# (section key, heading) included in the Flow 2 answer context
+_CONTEXT_SECTIONS = (
+    ("Mô tả", "Mô tả"),
+    ("Phân bố", "Phân bố"),
+    ("Công dụng", "Công dụng"),
+    ("Cách dùng", "Cách dùng"),
+    ("Thành phần", "Thành phần"),
+    ("Tính vị", "Tính vị"),
+    ("Bộ phận dùng", "Bộ phận dùng"),
+    ("luu_y", "Lưu ý")
+)
+
+
+def build_plant_context(plant_data: Dict) -> str:
+    """Build complete Markdown plant context (sent to the LLM in Flow 2)"""
+    # Basic info
+    context_parts = [_CONTEXT_HEADER.format(
+        ten=plant_data.get('ten', ''),
+        ten_khoa_hoc=plant_data.get('ten_khoa_hoc', ''),
+        ho=plant_data.get('ho', '')
+    )]
+    
+    # Sections
+    for key, title in _CONTEXT_SECTIONS:
+        section_data = plant_data.get(key)
+        if section_data and isinstance(section_data, dict):
+            context_parts.append(f"\n### {title}")
+            context_parts.extend(f"- **{sub_key}**: {sub_value}"
+                                 for sub_key, sub_value in section_data.items() if sub_value)
+    
+    return "\n".join(context_parts)
 
 
 class PlantDataLoader:
@@ -19,8 +149,18 @@ class PlantDataLoader:
             data_dir: Directory containing JSON-LD files
         """
         self.data_dir = Path(data_dir)
-        self._class_to_file_cache = {}
+        # Plants are numbered in index order: the alias indexes store that
+        # small int, which indexes the plant list below
+        self._class_to_file_id: Dict[str, int] = {}
         self._class_to_name_cache = {}
+        # Listing results, fixed once the index is built
+        self._plant_names: List[str] = []  # Distinct values of _class_to_name_cache
+        self._class_names: List[str] = []
+        self._plant_count = 0
+        # Exact-case names whose case-folded key is shared by several plants
+        self._case_sensitive_aliases: Dict[str, int] = {}
+        # All plant data, parsed once at startup, by file ID
+        self._plants: List[Dict] = []
         
         # Load CV model class mapping (from CSV)
         self._cv_class_mapping = self._load_cv_class_mapping()
@@ -32,11 +172,9 @@ class PlantDataLoader:
         try:
             mapping_file = Path("cv_class_to_vietnamese.json")
             if mapping_file.exists():
-                with open(mapping_file, 'r', encoding='utf-8') as f:
-                    import json
-                    mapping = json.load(f)
-                    print(f"Loaded CV class mapping: {len(mapping)} classes")
-                    return mapping
+                mapping = orjson.loads(mapping_file.read_bytes())
+                print(f"Loaded CV class mapping: {len(mapping)} classes")
+                return mapping
         except Exception as e:
             print(f"Warning: Could not load CV mapping: {e}")
         
@@ -48,10 +186,19 @@ class PlantDataLoader:
         
         jsonld_files = list(self.data_dir.glob("ontology_node_*.jsonld"))
         
-        for jsonld_file in jsonld_files:
+        # Read + parse concurrently; the caches are filled below, in file
+        # order, on this thread only
+        with ThreadPoolExecutor(max_workers=min(32, len(jsonld_files) or 1)) as executor:
+            loaded = list(executor.map(self._load_indexed_plant, jsonld_files))
+        
+        known_names = set()  # Every plant name indexed so far
+        alias_origins: Dict[str, str] = {}  # Case-folded key -> alias that set it
+        alias_names = set()  # Every alias as written and lower-cased
+        for jsonld_file, plant_data in zip(jsonld_files, loaded):
             try:
-                plant_data = self._load_jsonld_file(jsonld_file)
                 if plant_data:
+                    file_id = len(self._plants)
+                    self._plants.append(plant_data)
                     plant_name = plant_data.get("ten", "")
                     scientific_name = plant_data.get("ten_khoa_hoc", "")
                     
@@ -60,27 +207,53 @@ class PlantDataLoader:
                     class_name = self._scientific_to_class(scientific_name)
                     
                     # Index by scientific underscore format (for CV API compatibility)
+                    # and by Vietnamese name, one case-folded key per alias
+                    # (lookups fold the same way, so they are case-insensitive)
                     if class_name:
-                        self._class_to_file_cache[class_name] = jsonld_file.name
+                        self._index_alias(class_name, file_id, alias_origins, alias_names)
                         self._class_to_name_cache[class_name] = plant_name
+                        known_names.add(plant_name)
                     
-                    # Also index by Vietnamese name for direct lookup
                     if plant_name:
-                        self._class_to_file_cache[plant_name] = jsonld_file.name
+                        self._index_alias(plant_name, file_id, alias_origins, alias_names)
                         # Add to name cache if not already there
-                        if plant_name not in self._class_to_name_cache.values():
+                        if plant_name not in known_names:
                             self._class_to_name_cache[plant_name] = plant_name
-                    
-                    # Also index by lowercase versions for case-insensitive lookup
-                    if class_name:
-                        self._class_to_file_cache[class_name.lower()] = jsonld_file.name
-                    if plant_name:
-                        self._class_to_file_cache[plant_name.lower()] = jsonld_file.name
+                            known_names.add(plant_name)
                         
             except Exception as e:
                 print(f"Warning: Failed to index {jsonld_file.name}: {e}")
         
-        print(f"Indexed {len(set(self._class_to_file_cache.values()))} plants")
+        # Later plants may overwrite a class's name, so list the final values
+        plant_names = set(self._class_to_name_cache.values())
+        self._plant_names = list(plant_names)
+        self._class_names = [k for k in alias_names if k not in plant_names]
+        self._plant_count = len(set(self._class_to_file_id.values()))
+        print(f"Indexed {self._plant_count} plants")
+    
+    def _index_alias(
+        self,
+        alias: str,
+        file_id: int,
+        alias_origins: Dict[str, str],
+        alias_names: set
+    ):
+        """
+        Index a name under its case-folded key
+        
+        Names that differ only in case but belong to different plants
+        (e.g. "Đậu chiều" / "Đậu Chiều") also keep exact-case entries, so
+        an exact match still finds its own plant.
+        """
+        alias_names.add(alias)
+        alias_names.add(alias.lower())
+        key = alias.casefold()
+        previous = self._class_to_file_id.get(key)
+        if previous is not None and previous != file_id:
+            self._case_sensitive_aliases.setdefault(alias_origins[key], previous)
+            self._case_sensitive_aliases[alias] = file_id
+        self._class_to_file_id[key] = file_id
+        alias_origins[key] = alias
     
     @staticmethod
     def _scientific_to_class(scientific_name: str) -> str:
@@ -99,88 +272,46 @@ class PlantDataLoader:
         if not scientific_name:
             return ""
         
-        import re
-        
-        # Remove everything in parentheses (author citations)
-        clean = re.sub(r'\([^)]*\)', '', scientific_name)
+        # Remove everything in parentheses (author citations); most names
+        # have none, so the regex only runs when there is a "("
+        if '(' in scientific_name:
+            scientific_name = _PARENS_RE.sub('', scientific_name)
         
-        # Normalize whitespace (multiple spaces → single space)
-        clean = ' '.join(clean.split())
+        # Extract words (split() also collapses repeated spaces)
+        parts = scientific_name.split()
+        if not parts:
+            return ""
         
-        # Extract words
-        parts = clean.split()
+        # Only take the NEXT word(s) that look like species name (lowercase)
+        # Stop at uppercase (author names like "Urb.")
+        end = 1
+        while end < len(parts) and not parts[end][0].isupper():
+            end += 1
         
-        if len(parts) >= 2:
-            genus = parts[0]
-            # Only take the NEXT word(s) that look like species name (lowercase)
-            # Stop at uppercase (author names like "Urb.")
-            species_parts = []
-            for part in parts[1:]:
-                if part[0].isupper():  # Author name starts - stop here
-                    break
-                species_parts.append(part)
-            
-            if species_parts:
-                species = ''.join(species_parts)  # Join "asiati" + "ca" -> "asiatica"
-                return f"{genus}_{species}"
+        if end > 1:
+            species = ''.join(parts[1:end])  # Join "asiati" + "ca" -> "asiatica"
+            return f"{parts[0]}_{species}"
         
         # Fallback
-        return parts[0] if parts else ""
+        return parts[0]
     
-    def _load_jsonld_file(self, file_path: Path) -> Optional[Dict]:
-        """
-        Load and extract plant data from JSON-LD file
-        
-        Merges ALL nodes from @graph into a single plant dictionary:
-        - Plant node (metadata)
-        - Mô tả node
-        - Phân bố node
-        - Công dụng node
-        - etc.
-        
-        Args:
-            file_path: Path to JSON-LD file
-            
-        Returns:
-            Complete plant data dictionary with all sections merged
-        """
+    def _load_indexed_plant(self, file_path: Path) -> Optional[Dict]:
+        """Load one plant file with its summary and context (worker thread)"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Extract and merge all nodes from @graph
-            if "@graph" in data:
-                plant_data = {}
-                
-                for node in data["@graph"]:
-                    if not isinstance(node, dict):
-                        continue
-                    
-                    node_type = node.get("@type")
-                    
-                    if node_type == "Plant":
-                        # Plant node is the base - copy all fields
-                        plant_data.update(node)
-                    elif node_type:
-                        # Other nodes (Mô tả, Phân bố, Công dụng, etc.)
-                        # Add as a section with the @type as key
-                        section_data = {k: v for k, v in node.items() if k != "@type"}
-                        
-                        # Skip if section is empty or all null
-                        if section_data and any(v is not None for v in section_data.values()):
-                            plant_data[node_type] = section_data
-                
-                return plant_data if plant_data else None
-            
-            # If @graph doesn't exist, check if it's the plant node directly
-            if data.get("@type") == "Plant":
-                return data
-                
-            return None
+            plant_data = self._load_jsonld_file(file_path)
+            if plant_data:
+                # Summaries and contexts only depend on static data - build them once here
+                plant_data["_summary"] = build_plant_summary(plant_data)
+                plant_data["_context"] = build_plant_context(plant_data)
+            return plant_data
         except Exception as e:
-            print(f"Error loading {file_path}: {e}")
+            print(f"Warning: Failed to index {file_path.name}: {e}")
             return None
     
+    def _load_jsonld_file(self, file_path: Path) -> Optional[Dict]:
+        """Load and extract plant data from JSON-LD file (see load_jsonld_file)"""
+        return load_jsonld_file(file_path)
+    
     def get_plant_by_class(self, class_name: str) -> Optional[Dict]:
         """
         Get full plant data by class name
@@ -196,19 +327,17 @@ class PlantDataLoader:
         Returns:
             Full plant data dictionary
         """
-        # Try CV model class mapping first (most accurate)
-        if class_name in self._cv_class_mapping:
-            vietnamese_name = self._cv_class_mapping[class_name]
-            return self.get_plant_by_name(vietnamese_name)
-        
-        # Fallback to cache lookup
-        if class_name not in self._class_to_file_cache:
+        # CV model class mapping first (most accurate), else the name itself;
+        # both resolve to a file parsed once at startup - no disk access here
+        lookup_name = self._cv_class_mapping.get(class_name, class_name)
+        file_id = None
+        if self._case_sensitive_aliases:
+            file_id = self._case_sensitive_aliases.get(lookup_name)
+        if file_id is None:
+            file_id = self._class_to_file_id.get(lookup_name.casefold())
+        if file_id is None:
             return None
-        
-        file_name = self._class_to_file_cache[class_name]
-        file_path = self.data_dir / file_name
-        
-        return self._load_jsonld_file(file_path)
+        return self._plants[file_id]
     
     def get_plant_by_name(self, vietnamese_name: str) -> Optional[Dict]:
         """
@@ -224,22 +353,32 @@ class PlantDataLoader:
     
     def get_all_plant_names(self) -> List[str]:
         """Get list of all Vietnamese plant names"""
-        return list(set(self._class_to_name_cache.values()))
+        return list(self._plant_names)
     
     def get_all_class_names(self) -> List[str]:
-        """Get list of all class names"""
-        return list(set(k for k in self._class_to_file_cache.keys() 
-                       if k not in self._class_to_name_cache.values()))
+        """
+        Get list of all class names
+        
+        Every lookup key that is not a plant name: scientific class names
+        plus lower-cased class and plant names, as accepted by
+        get_plant_by_class().
+        """
+        return list(self._class_names)
     
     def count_plants(self) -> int:
         """Get total number of plants"""
-        return len(set(self._class_to_file_cache.values()))
+        return self._plant_count
+
 
+# Singleton instances (one per data directory)
+_plant_data_loaders: Dict[str, PlantDataLoader] = {}
 
-@lru_cache()
 def get_plant_data_loader(data_dir: str = "data") -> PlantDataLoader:
     """Get cached plant data loader instance"""
-    return PlantDataLoader(data_dir)
+    loader = _plant_data_loaders.get(data_dir)
+    if loader is None:
+        loader = _plant_data_loaders[data_dir] = PlantDataLoader(data_dir)
+    return loader
 
 
 # Test if run directly
@@ -2,6 +2,7 @@
 Vietnamese Key Normalizer
 Converts snake_case English keys to proper Vietnamese
 """
+from typing import List, Sequence
 
 KEY_MAPPING = {
     # Basic Plant Info
@@ -11,15 +12,6 @@ KEY_MAPPING = {
     "ma_taxon": "Mã taxon",
     "ho": "Họ",
     
-    # Section Names (already Vietnamese, keep as is)
-    "Mô tả": "Mô tả",
-    "Phân bố": "Phân bố",
-    "Công dụng": "Công dụng",
-    "Cách dùng": "Cách dùng",
-    "Thành phần": "Thành phần",
-    "Tính vị": "Tính vị",
-    "Bộ phận dùng": "Bộ phận dùng",
-    "Thông tin khác": "Thông tin khác",
     "luu_y": "Lưu ý",
     
     # Mô tả sub-keys
@@ -40,7 +32,6 @@ KEY_MAPPING = {
     "phân_bố": "Phân bố địa lý",
     "thuong_moc": "Thường mọc",
     "thường_mọc": "Thường mọc",
-    "Đặc điểm sinh trưởng": "Đặc điểm sinh trưởng",
     
     # Công dụng sub-keys
     "cong_dung_y_hoc": "Công dụng y học",
@@ -58,23 +49,36 @@ KEY_MAPPING = {
     
     # Thành phần sub-keys
     "thành phần": "Thành phần hóa học",
-    "Các hợp chất": "Các hợp chất",
     "chứa": "Chứa chất",
     "đã nghiên cứu": "Đã nghiên cứu",
     "gồm chất": "Gồm chất",
     "tìm thấy": "Tìm thấy",
-    "Ngoài ra": "Ngoài ra",
     
     # Bộ phận dùng
     "bo_phan_dung": "Bộ phận dùng",
     
     # Thông tin khác
     "thong_tin_khac": "Thông tin khác",
-    
-    # Tính vị
-    "Có vị": "Có vị",
 }
 
+# Keys that are already normalized (section names and Vietnamese sub-keys).
+# normalize_key() returns unmapped keys unchanged, so they need no
+# KEY_MAPPING entry; they are only listed for get_all_normalized_keys()
+NORMALIZED_KEYS = (
+    "Mô tả",
+    "Phân bố",
+    "Công dụng",
+    "Cách dùng",
+    "Thành phần",
+    "Tính vị",
+    "Bộ phận dùng",
+    "Thông tin khác",
+    "Đặc điểm sinh trưởng",
+    "Các hợp chất",
+    "Ngoài ra",
+    "Có vị",
+)
+
 
 def normalize_key(key: str) -> str:
     """
@@ -90,6 +94,20 @@ def normalize_key(key: str) -> str:
     return KEY_MAPPING.get(key, key)
 
 
+def normalize_keys_batch(keys: Sequence[str]) -> List[str]:
+    """
+    Normalize many keys at once (same result as normalize_key per key)
+    
+    Args:
+        keys: Input keys
+        
+    Returns:
+        Normalized Vietnamese keys, in input order
+    """
+    mapped = KEY_MAPPING.get  # Bound once instead of per key
+    return [mapped(key, key) for key in keys]
+
+
 def get_all_normalized_keys():
     """Get list of all possible normalized keys"""
-    return list(set(KEY_MAPPING.values()))
+    return list(set(KEY_MAPPING.values()).union(NORMALIZED_KEYS))
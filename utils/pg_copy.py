@@ -0,0 +1,140 @@
+"""
+Postgres COPY helpers for bulk-loading HyperNodes
+Shared by the import scripts that talk to the database directly (SUPABASE_DB_URI)
+"""
+import io
+import hashlib
+from typing import Any, Dict, Iterable, Set
+
+
+_COLUMNS = (
+    "key, value, plant_name, section, chunk_id, is_chunked, "
+    "key_embedding, value_embedding"
+)
+
+# Rows are COPY'd into a temp staging table and then merged, so nodes that
+# already exist (same content_hash) are skipped instead of failing the batch
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS hypernodes_staging (
+        key TEXT,
+        value TEXT,
+        plant_name TEXT,
+        section TEXT,
+        chunk_id INTEGER,
+        is_chunked BOOLEAN,
+        key_embedding vector,
+        value_embedding vector
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_SQL = f"COPY hypernodes_staging ({_COLUMNS}) FROM STDIN"
+
+MERGE_SQL = f"""
+    INSERT INTO hypernodes ({_COLUMNS})
+    SELECT {_COLUMNS} FROM hypernodes_staging
+    ON CONFLICT (content_hash) DO NOTHING
+"""
+
+# pgvector indexes are dropped before a bulk load and rebuilt afterwards:
+# building an HNSW index once is far cheaper than maintaining it per row
+VECTOR_INDEXES = {
+    "hypernodes_key_embedding_idx": "key_embedding",
+    "hypernodes_value_embedding_idx": "value_embedding",
+}
+
+# COPY text format escapes
+_COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+})
+
+
+def content_hash(plant_name: str, key: str, value: str) -> str:
+    """
+    Hash identifying a node's content
+    
+    Must match the generated hypernodes.content_hash column:
+    md5(plant_name || '|' || key || '|' || value)
+    """
+    return hashlib.md5(f"{plant_name}|{key}|{value}".encode("utf-8")).hexdigest()
+
+
+def fetch_content_hashes(cursor) -> Set[str]:
+    """Load the content hashes of every node already in the database"""
+    cursor.execute("SELECT content_hash FROM hypernodes")
+    return {row[0] for row in cursor}
+
+
+def _copy_text(value) -> str:
+    """Encode a nullable text field for COPY text format"""
+    if value is None:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _copy_vector(embedding) -> str:
+    """Encode an embedding as a pgvector text literal"""
+    return "[" + ",".join(map(str, embedding)) + "]"
+
+
+def build_copy_buffer(nodes: Iterable[Dict[str, Any]]) -> io.StringIO:
+    """
+    Build a COPY text-format buffer for a batch of nodes
+    
+    Args:
+        nodes: HyperNodes with key, value, plant_name, both embeddings and
+            optional section / chunk_id / is_chunked
+        
+    Returns:
+        Buffer positioned at the start, ready for cursor.copy_expert
+    """
+    buf = io.StringIO()
+    for node in nodes:
+        buf.write("\t".join((
+            _copy_text(node["key"]),
+            _copy_text(node["value"]),
+            _copy_text(node["plant_name"]),
+            _copy_text(node.get("section")),
+            str(int(node.get("chunk_id") or 0)),
+            "t" if node.get("is_chunked") else "f",
+            _copy_vector(node["key_embedding"]),
+            _copy_vector(node["value_embedding"]),
+        )))
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+
+def copy_hypernodes(cursor, nodes: Iterable[Dict[str, Any]]) -> int:
+    """
+    COPY a batch of nodes into hypernodes, skipping ones that already exist
+    
+    The caller owns the transaction.
+    
+    Returns:
+        Number of rows actually inserted
+    """
+    cursor.execute(CREATE_STAGING_SQL)
+    cursor.copy_expert(COPY_SQL, build_copy_buffer(nodes))
+    cursor.execute(MERGE_SQL)
+    inserted = cursor.rowcount
+    cursor.execute("TRUNCATE hypernodes_staging")
+    return inserted
+
+
+def drop_vector_indexes(cursor):
+    """Drop the HNSW indexes ahead of a bulk load"""
+    for index_name in VECTOR_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def create_vector_indexes(cursor):
+    """(Re)build the HNSW indexes after a bulk load"""
+    for index_name, column in VECTOR_INDEXES.items():
+        print(f"  Building {index_name}...")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON hypernodes "
+            f"USING hnsw ({column} vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )